@@ -0,0 +1,11 @@
+-- Auth sessions are always looked up by user and device
+CREATE INDEX IF NOT EXISTS auth_user_id_device_id ON auth (user_id, device_id, token_id, family_id, is_invalidated);
+
+-- Game settings by user
+CREATE INDEX IF NOT EXISTS game_settings_user_id ON game_settings (user_id, modified_at);
+
+-- Time records by user, sorted by creation time (keyset pagination)
+CREATE INDEX IF NOT EXISTS time_records_user_id_created_at ON time_records (user_id, created_at, id, difficulty, time);
+
+-- Time records by user and difficulty, sorted by creation time
+CREATE INDEX IF NOT EXISTS time_records_user_id_difficulty_created_at ON time_records (user_id, difficulty, created_at, id, time);
@@ -0,0 +1,18 @@
+-- Leaderboard table
+-- Best time of each user per difficulty, only the top entries are kept (LEADERBOARD_SIZE)
+CREATE TABLE IF NOT EXISTS leaderboard (
+	difficulty INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	record_id VARCHAR NOT NULL,
+	time INTEGER NOT NULL,
+	created_at DATETIME NOT NULL,
+	PRIMARY KEY (difficulty, user_id),
+	FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE INDEX IF NOT EXISTS leaderboard_difficulty_time ON leaderboard (difficulty, time, created_at, user_id);
+
+-- Time records by difficulty, sorted by time (next best times when an entry leaves the leaderboard)
+CREATE INDEX IF NOT EXISTS time_records_difficulty_time ON time_records (difficulty, time, created_at, user_id, id);
+
+-- The app fills the leaderboard from the existing records at startup (LEADERBOARD_SIZE)
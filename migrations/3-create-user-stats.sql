@@ -0,0 +1,22 @@
+-- User stats table
+-- Aggregates of the time records of each user per difficulty
+-- count, best and total are kept up to date on every write, median, p90 and trend are recomputed when is_stale
+CREATE TABLE IF NOT EXISTS user_stats (
+	user_id INTEGER NOT NULL,
+	difficulty INTEGER NOT NULL,
+	count INTEGER NOT NULL,
+	best INTEGER NOT NULL,
+	total INTEGER NOT NULL,
+	median REAL,
+	p90 REAL,
+	trend REAL,
+	is_stale BOOLEAN NOT NULL DEFAULT 1,
+	PRIMARY KEY (user_id, difficulty),
+	FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+-- Fill the table with the existing records, the rest is computed on the first request
+INSERT INTO user_stats (user_id, difficulty, count, best, total)
+SELECT user_id, difficulty, COUNT(*), MIN(time), SUM(time)
+FROM time_records
+GROUP BY user_id, difficulty;
@@ -0,0 +1,7 @@
+-- Time distributions table
+-- Checkpoints of the in-memory quantile sketch of each difficulty (JSON)
+CREATE TABLE IF NOT EXISTS time_distributions (
+	difficulty INTEGER PRIMARY KEY,
+	sketch TEXT NOT NULL,
+	updated_at DATETIME NOT NULL
+);
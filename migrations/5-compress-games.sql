@@ -0,0 +1,20 @@
+-- Games table with encoded_game as BLOB (compressed payloads)
+-- Rows saved before keep their text values, they are read as they are and compressed on their next update
+CREATE TABLE IF NOT EXISTS games_compressed (
+	id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	difficulty INTEGER NOT NULL,
+	encoded_game BLOB NOT NULL,
+	created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	UNIQUE (user_id, difficulty),
+	PRIMARY KEY (id),
+	FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+INSERT INTO games_compressed (id, user_id, difficulty, encoded_game, created_at)
+SELECT id, user_id, difficulty, encoded_game, created_at
+FROM games;
+
+DROP TABLE games;
+
+ALTER TABLE games_compressed RENAME TO games;
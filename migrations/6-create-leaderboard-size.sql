@@ -0,0 +1,6 @@
+-- Leaderboard size table
+-- LEADERBOARD_SIZE the leaderboard was last filled with, the app fills it again at startup when the setting changes
+CREATE TABLE IF NOT EXISTS leaderboard_size (
+	id INTEGER PRIMARY KEY CHECK (id = 0),
+	size INTEGER NOT NULL
+);
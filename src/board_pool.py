@@ -0,0 +1,112 @@
+from typing import Callable
+from threading import Condition, Thread
+from collections import deque
+from functools import partial
+from boards import DIFFICULTIES, generate_game
+from metrics import metrics
+import settings
+import secrets
+import time
+
+
+# (seed, encoded_game)
+GeneratedGame = tuple[int, str]
+
+
+class BoardPool:
+    '''
+    Boards generated ahead of time per difficulty by a background thread,
+    so requests only dequeue one. The thread sleeps while every pool is full.
+
+    Metrics are prefixed with `games.pool.{name}`.
+    '''
+
+    def __init__(self, name: str, size: int, refill_per_second: int, generate: Callable[[int, int], str]):
+        self.name = name
+        self.size = size
+        self.refill_interval = 1 / refill_per_second if refill_per_second > 0 else 0
+        self.generate = generate
+        self.games: dict[int, deque[GeneratedGame]] = {difficulty: deque() for difficulty in DIFFICULTIES}
+        self.condition = Condition()
+        self.thread: Thread | None = None
+        self.is_running = False
+
+        for difficulty, games in self.games.items():
+            metrics.register_gauge(f'games.pool.{name}.size.{difficulty}', partial(len, games))
+
+    def start(self) -> None:
+        if self.thread is not None or self.size <= 0:
+            return
+
+        self.is_running = True
+        self.thread = Thread(target=self._fill, name=f'board-pool-{self.name}', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread is None:
+            return
+
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+
+        self.thread.join()
+        self.thread = None
+
+    def pop(self, difficulty: int) -> GeneratedGame | None:
+        with self.condition:
+            games = self.games[difficulty]
+
+            if not games:
+                metrics.increment(f'games.pool.{self.name}.misses')
+                return None
+
+            game = games.popleft()
+            self.condition.notify()
+
+        metrics.increment(f'games.pool.{self.name}.hits')
+
+        return game
+
+    def _get_emptiest_difficulty(self) -> int | None:
+        difficulty, games = min(self.games.items(), key=lambda item: len(item[1]))
+        return difficulty if len(games) < self.size else None
+
+    def _fill(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.is_running or self._get_emptiest_difficulty() is not None)
+
+                if not self.is_running:
+                    return
+
+                difficulty = self._get_emptiest_difficulty()
+
+            if difficulty is None:
+                continue
+
+            start_time = time.perf_counter()
+
+            seed = secrets.randbits(63)
+            encoded_game = self.generate(difficulty, seed)
+
+            generation_time = time.perf_counter() - start_time
+
+            metrics.increment(f'games.pool.{self.name}.generated')
+            metrics.observe(f'games.pool.{self.name}.generation_ms', generation_time * 1_000)
+
+            with self.condition:
+                self.games[difficulty].append((seed, encoded_game))
+
+                # Refill rate limit, woken up early by `stop`
+                if generation_time < self.refill_interval:
+                    self.condition.wait_for(lambda: not self.is_running, timeout=self.refill_interval - generation_time)
+
+
+board_pool = BoardPool('random', settings.BOARD_POOL_SIZE, settings.BOARD_POOL_REFILL_PER_SECOND, generate_game)
+no_guess_board_pool = BoardPool(
+    'no_guess',
+    settings.BOARD_POOL_SIZE,
+    settings.BOARD_POOL_REFILL_PER_SECOND,
+    partial(generate_game, first_click=None, no_guess=True)
+)
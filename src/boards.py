@@ -0,0 +1,254 @@
+from typing import NamedTuple
+import numpy as np
+import numpy.typing as npt
+
+
+class Difficulty(NamedTuple):
+    rows: int
+    columns: int
+    mines: int
+
+
+DIFFICULTIES = {
+    0: Difficulty(9, 9, 10),
+    1: Difficulty(16, 16, 40),
+    2: Difficulty(16, 30, 99),
+}
+
+# Cell flags, every cell of a generated board is the digit of its flags (row-major)
+MINE = 1
+REVEALED = 2
+FLAGGED = 4
+
+Board = npt.NDArray[np.uint8]
+Mask = npt.NDArray[np.bool_]
+
+# (row, column)
+Cell = tuple[int, int]
+
+# Tolerance of the linear solver
+EPSILON = 1e-9
+
+
+def encode_board(board: Board) -> str:
+    # Revealed cells cannot be flagged
+    board = np.where(board & REVEALED, board & (0xFF ^ FLAGGED), board).astype(np.uint8)
+
+    return (board.ravel() + np.uint8(ord('0'))).tobytes().decode('ascii')
+
+
+def get_default_first_click(difficulty: int) -> Cell:
+    rows, columns, _ = DIFFICULTIES[difficulty]
+    return rows // 2, columns // 2
+
+
+def get_cell_mask(shape: tuple[int, int], cell: Cell) -> Mask:
+    mask = np.zeros(shape, dtype=np.bool_)
+    mask[cell] = True
+
+    return mask
+
+
+def get_neighborhood(shape: tuple[int, int], cell: Cell) -> Mask:
+    '''
+    The cell and its neighbors.
+    '''
+    mask = np.zeros(shape, dtype=np.bool_)
+    mask[max(cell[0] - 1, 0):cell[0] + 2, max(cell[1] - 1, 0):cell[1] + 2] = True
+
+    return mask
+
+
+def sum_neighbors(values: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    '''
+    Sum of the 8 neighbors of every cell, adding shifted copies of the zero padded array
+    (rows first, then columns, minus the cell itself).
+    '''
+    rows, columns = values.shape
+
+    padded = np.zeros((rows + 2, columns + 2), dtype=values.dtype)
+    padded[1:-1, 1:-1] = values
+
+    row_sums = padded[:, :-2] + padded[:, 1:-1] + padded[:, 2:]
+
+    return row_sums[:-2] + row_sums[1:-1] + row_sums[2:] - values
+
+
+def dilate(mask: Mask) -> Mask:
+    return mask | (sum_neighbors(mask.astype(np.uint8)) > 0)
+
+
+def place_mines(difficulty: int, first_click: Cell, rng: np.random.Generator) -> Mask:
+    '''
+    The first click and its neighbors never have mines, so it always opens an area.
+    '''
+    rows, columns, mines = DIFFICULTIES[difficulty]
+
+    candidates = np.flatnonzero(~get_neighborhood((rows, columns), first_click))
+
+    mine_mask = np.zeros(rows * columns, dtype=np.bool_)
+    mine_mask[rng.choice(candidates, size=mines, replace=False)] = True
+
+    return mine_mask.reshape(rows, columns)
+
+
+def reveal(mine_mask: Mask, neighbor_mines: npt.NDArray[np.uint8], clicked: Mask) -> Mask:
+    '''
+    Cells revealed by clicking the cells of `clicked`,
+    cells without neighbor mines reveal their neighbors (flood fill by dilation).
+    '''
+    revealed = clicked & ~mine_mask
+    empty = (neighbor_mines == 0) & ~mine_mask
+
+    while True:
+        expanded = (revealed | dilate(revealed & empty)) & ~mine_mask
+
+        if (expanded == revealed).all():
+            return revealed
+
+        revealed = expanded
+
+
+def deduce_locally(revealed: Mask, known_mines: Mask, neighbor_mines: npt.NDArray[np.uint8]) -> tuple[Mask, Mask]:
+    '''
+    Returns the cells that are safe and the ones that are mines according to single numbers:
+    numbers with all their mines found make the rest of their neighbors safe,
+    numbers with as many unknown neighbors as missing mines make them mines.
+    '''
+    unknown = ~revealed & ~known_mines
+    unknown_neighbors = sum_neighbors(unknown.astype(np.uint8))
+    missing_mines = neighbor_mines.astype(np.int16) - sum_neighbors(known_mines.astype(np.uint8))
+
+    constrained = revealed & (unknown_neighbors > 0)
+    satisfied = constrained & (missing_mines == 0)
+    full = constrained & (missing_mines == unknown_neighbors)
+
+    safe = unknown & (sum_neighbors(satisfied.astype(np.uint8)) > 0)
+    mines = unknown & (sum_neighbors(full.astype(np.uint8)) > 0)
+
+    return safe, mines
+
+
+def deduce_globally(revealed: Mask, known_mines: Mask, neighbor_mines: npt.NDArray[np.uint8]) -> tuple[Mask, Mask]:
+    '''
+    Solves the numbers on the frontier together as a linear system (covers the subset rules).
+    Every row of its reduced row echelon form is checked against the bounds of its 0/1 unknowns:
+    if the value can only be reached with all the positive unknowns as mines and all the negative ones safe
+    (or the other way around), they are deduced.
+    '''
+    shape = revealed.shape
+    unknown = ~revealed & ~known_mines
+    unknown_neighbors = sum_neighbors(unknown.astype(np.uint8))
+    missing_mines = neighbor_mines.astype(np.int16) - sum_neighbors(known_mines.astype(np.uint8))
+
+    constraints = np.argwhere(revealed & (unknown_neighbors > 0))
+    variables = np.flatnonzero(unknown & (sum_neighbors((revealed & (unknown_neighbors > 0)).astype(np.uint8)) > 0))
+
+    safe = np.zeros(shape, dtype=np.bool_)
+    mines = np.zeros(shape, dtype=np.bool_)
+
+    if not len(constraints):
+        return safe, mines
+
+    variable_columns = np.full(unknown.size, -1)
+    variable_columns[variables] = np.arange(len(variables))
+
+    system = np.zeros((len(constraints), len(variables) + 1))
+
+    for equation, (row, column) in enumerate(constraints):
+        neighborhood = get_neighborhood(shape, (row, column)) & unknown
+        system[equation, variable_columns[np.flatnonzero(neighborhood)]] = 1
+        system[equation, -1] = missing_mines[row, column]
+
+    reduce_rows(system)
+
+    coefficients, values = system[:, :-1], system[:, -1]
+    positive, negative = coefficients > EPSILON, coefficients < -EPSILON
+    max_values = np.where(positive, coefficients, 0).sum(axis=1)
+    min_values = np.where(negative, coefficients, 0).sum(axis=1)
+
+    at_max = np.abs(values - max_values) < EPSILON
+    at_min = np.abs(values - min_values) < EPSILON
+    is_determined = (at_max | at_min) & (positive | negative).any(axis=1)
+
+    mine_variables = ((positive & (at_max & is_determined)[:, None]) | (negative & (at_min & is_determined)[:, None])).any(axis=0)
+    safe_variables = ((negative & (at_max & is_determined)[:, None]) | (positive & (at_min & is_determined)[:, None])).any(axis=0)
+
+    mines.flat[variables[mine_variables]] = True
+    safe.flat[variables[safe_variables]] = True
+
+    return safe, mines
+
+
+def reduce_rows(system: npt.NDArray[np.float64]) -> None:
+    '''
+    In place reduced row echelon form (Gauss-Jordan with partial pivoting), the last column are the values.
+    '''
+    rows, columns = system.shape
+    pivot_row = 0
+
+    for column in range(columns - 1):
+        if pivot_row == rows:
+            return
+
+        candidate = pivot_row + int(np.argmax(np.abs(system[pivot_row:, column])))
+
+        if abs(system[candidate, column]) < EPSILON:
+            continue
+
+        system[[pivot_row, candidate]] = system[[candidate, pivot_row]]
+        system[pivot_row] /= system[pivot_row, column]
+
+        factors = system[:, column].copy()
+        factors[pivot_row] = 0
+        system -= np.outer(factors, system[pivot_row])
+
+        pivot_row += 1
+
+
+def is_solvable(mine_mask: Mask, neighbor_mines: npt.NDArray[np.uint8], first_click: Cell) -> bool:
+    '''
+    Whether every safe cell can be revealed from the first click without guessing.
+    '''
+    revealed = reveal(mine_mask, neighbor_mines, get_cell_mask(mine_mask.shape, first_click))
+    known_mines = np.zeros(mine_mask.shape, dtype=np.bool_)
+
+    while not (revealed | mine_mask).all():
+        safe, mines = deduce_locally(revealed, known_mines, neighbor_mines)
+
+        if not safe.any() and not mines.any():
+            safe, mines = deduce_globally(revealed, known_mines, neighbor_mines)
+
+            if not safe.any() and not mines.any():
+                return False
+
+        known_mines |= mines
+        revealed |= reveal(mine_mask, neighbor_mines, safe)
+
+    return True
+
+
+def generate_board(difficulty: int, seed: int, first_click: Cell | None = None, no_guess: bool = False) -> Board:
+    '''
+    Board with its mines placed and the first click revealed.
+    With `no_guess`, mines are placed again until the board can be solved without guessing.
+    '''
+    if first_click is None:
+        first_click = get_default_first_click(difficulty)
+
+    rng = np.random.default_rng(seed)
+
+    while True:
+        mine_mask = place_mines(difficulty, first_click, rng)
+        neighbor_mines = sum_neighbors(mine_mask.astype(np.uint8))
+
+        if not no_guess or is_solvable(mine_mask, neighbor_mines, first_click):
+            break
+
+    revealed = reveal(mine_mask, neighbor_mines, get_cell_mask(mine_mask.shape, first_click))
+
+    return (mine_mask * np.uint8(MINE) | revealed * np.uint8(REVEALED)).astype(np.uint8)
+
+
+def generate_game(difficulty: int, seed: int, first_click: Cell | None = None, no_guess: bool = False) -> str:
+    return encode_board(generate_board(difficulty, seed, first_click, no_guess))
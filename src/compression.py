@@ -0,0 +1,48 @@
+from metrics import metrics
+import zlib
+
+
+# First byte of stored payloads, rows saved as text before compression have none
+RAW_TAG = b'\x00'
+ZLIB_TAG = b'\x01'
+
+COMPRESSION_LEVEL = 6
+
+
+def compress_text(value: str, metric_name: str) -> bytes:
+    '''
+    Payloads that do not get smaller are stored uncompressed.
+    `{metric_name}.raw_bytes` and `{metric_name}.stored_bytes` count the sizes before and after.
+    '''
+    raw = value.encode()
+    compressed = zlib.compress(raw, COMPRESSION_LEVEL)
+
+    stored = ZLIB_TAG + compressed if len(compressed) < len(raw) else RAW_TAG + raw
+
+    metrics.increment(f'{metric_name}.raw_bytes', len(raw))
+    metrics.increment(f'{metric_name}.stored_bytes', len(stored))
+
+    return stored
+
+
+def decompress_text(value: str | bytes) -> str:
+    if isinstance(value, str):
+        return value
+
+    tag, payload = value[:1], value[1:]
+
+    if tag == ZLIB_TAG:
+        return zlib.decompress(payload).decode()
+
+    if tag == RAW_TAG:
+        return payload.decode()
+
+    raise ValueError(f'Unknown compression tag: {tag!r}')
+
+
+def register_compression_ratio_gauge(metric_name: str) -> None:
+    def get_compression_ratio() -> float:
+        stored_bytes = metrics.get_counter(f'{metric_name}.stored_bytes')
+        return metrics.get_counter(f'{metric_name}.raw_bytes') / stored_bytes if stored_bytes else 0.0
+
+    metrics.register_gauge(f'{metric_name}.compression_ratio', get_compression_ratio)
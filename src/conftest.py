@@ -8,7 +8,7 @@ from jose import jwt
 import pytest
 
 # App
-from database import DBConnection, get_db_connection, TestDatabaseManager
+from database import DBConnection, get_db_connection, get_read_db_connection, get_read_db_connector, TestDatabaseManager
 from migrate import run_all_migrations
 from routers.auth import Tokens
 from routers.auth import generate_tokens_, authenticate_user
@@ -57,6 +57,8 @@ def db() -> Iterator[DBConnection]:
             yield conn
 
         app.dependency_overrides[get_db_connection] = get_db
+        app.dependency_overrides[get_read_db_connection] = get_db
+        app.dependency_overrides[get_read_db_connector] = lambda: contextmanager(get_db)
 
         yield conn
 
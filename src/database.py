@@ -1,13 +1,19 @@
-from fastapi import Depends
-from sqlalchemy import create_engine, text, Row, Connection, Engine, StaticPool
-from sqlalchemy.engine.url import make_url
-from sqlalchemy.exc import ResourceClosedError, DatabaseError
-from typing import Any, Sequence, Mapping, Annotated, Iterator
-from contextlib import contextmanager
+from fastapi import Depends, HTTPException, Request, Response, status
+from fastapi.routing import APIRoute
+from sqlalchemy import create_engine, event, text, Row, Connection, Engine, StaticPool, TextClause
+from sqlalchemy.engine.url import make_url, URL
+from sqlalchemy.exc import ResourceClosedError, DatabaseError, OperationalError
+from typing import Any, Sequence, Mapping, Annotated, Iterator, Callable, Awaitable, Coroutine, TypeVar
+from contextlib import contextmanager, AbstractContextManager
 from migrate import run_all_migrations
 from utils import print_exception
-from datetime import datetime, timedelta
+from metrics import metrics
+from datetime import timedelta
+from anyio import to_thread
 import settings
+import asyncio
+import random
+import re
 import signal
 import time
 import os
@@ -15,45 +21,208 @@ import os
 
 QueryParameter = Mapping[str, Any]
 
+T = TypeVar('T')
+
+PRAGMA_VALUES: dict[str, tuple[str, ...]] = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'temp_store': ('DEFAULT', 'FILE', 'MEMORY'),
+}
+
 
 TIME_BETWEEN_CONNECTION_CHECKS = timedelta(minutes=5)
 
+# `<module>.<name>`, eg: `times.get_all`
+statement_name_pattern = re.compile(r'^\w+(\.\w+)+$')
+
+
+class StatementRegistry:
+    '''
+    Named SQL statements, parsed once and reused by every request.
+    Reusing the same `TextClause` lets SQLAlchemy hit its compiled cache.
+    '''
+
+    def __init__(self) -> None:
+        self.statements: dict[str, TextClause] = {}
+
+    def register(self, name: str, statement: str) -> str:
+        if name in self.statements:
+            raise Exception(f'Statement `{name}` already registered.')
+
+        self.statements[name] = text(statement)
+
+        return name
+
+    def get(self, statement: str) -> TextClause:
+        '''
+        Returns the registered statement with that name,
+        otherwise `statement` is treated as raw SQL.
+        Names that are not registered raise `KeyError`, so a typo does not run as SQL.
+        '''
+        registered_statement = self.statements.get(statement)
+
+        if registered_statement is not None:
+            return registered_statement
+
+        if statement_name_pattern.match(statement):
+            raise KeyError(f'Statement `{statement}` is not registered.')
+
+        return text(statement)
+
+    def print_report(self) -> None:
+        print(f'Registered {len(self.statements)} SQL statements:')
+
+        for name in sorted(self.statements):
+            print(f'    {name}')
+
+
+statements = StatementRegistry()
+
+
+def get_parameters_shape(parameters: QueryParameter | Sequence[QueryParameter] | None) -> str:
+    '''
+    Describes the parameters without their values, eg: `2 x {user_id: int, id: str}`.
+    '''
+    if parameters is None:
+        return 'None'
+
+    if isinstance(parameters, Mapping):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+
+    if not parameters:
+        return '[]'
+
+    return f'{len(parameters)} x {get_parameters_shape(parameters[0])}'
+
+
+def record_query(statement: str, start_time: float, row_count: int, parameters: QueryParameter | Sequence[QueryParameter] | None) -> None:
+    duration_ms = (time.perf_counter() - start_time) * 1_000
+    name = statement if statement in statements.statements else 'raw'
+
+    metrics.observe(f'db.query.{name}.duration_ms', duration_ms)
+    metrics.increment(f'db.query.{name}.rows', row_count)
+
+    if duration_ms >= settings.DATABASE_SLOW_QUERY_MS:
+        print(f'Slow query `{name}`: {duration_ms:.2f}ms, {row_count} rows, parameters: {get_parameters_shape(parameters)}')
+
 
 class DBConnection:
     def __init__(self, connection: Connection):
         self.connection = connection
+        self.commit_callbacks: list[Callable[[], None]] = []
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        '''
+        Runs `callback` once the transaction is committed, it is discarded if it is rolled back.
+        For in memory state that must only reflect committed rows (eg: caches).
+        '''
+        self.commit_callbacks.append(callback)
+
+    def run_commit_callbacks(self) -> None:
+        callbacks, self.commit_callbacks = self.commit_callbacks, []
+
+        for callback in callbacks:
+            callback()
 
     def fetch_one(self, statement: str, parameters: QueryParameter | Sequence[QueryParameter] | None = None) -> Row[Any] | None:
-        result = self.connection.execute(text(statement), parameters)
+        start_time = time.perf_counter()
+        result = self.connection.execute(statements.get(statement), parameters)
 
         try:
-            return result.first()
+            row = result.first()
         except ResourceClosedError:
-            return None
+            row = None
+
+        record_query(statement, start_time, int(row is not None), parameters)
+
+        return row
 
     def fetch_many(self, statement: str, parameters: QueryParameter | Sequence[QueryParameter] | None = None) -> Sequence[Row[Any]]:
-        result = self.connection.execute(text(statement), parameters)
+        start_time = time.perf_counter()
+        result = self.connection.execute(statements.get(statement), parameters)
 
         try:
-            return result.all()
+            rows = result.all()
         except ResourceClosedError:
-            return []
+            rows = []
+
+        record_query(statement, start_time, len(rows), parameters)
+
+        return rows
 
     def execute(self, statement: str, parameters: QueryParameter | Sequence[QueryParameter] | None = None) -> None:
-        self.connection.execute(text(statement), parameters)
+        start_time = time.perf_counter()
+        result = self.connection.execute(statements.get(statement), parameters)
+
+        record_query(statement, start_time, max(result.rowcount, 0), parameters)
 
     def commit(self) -> None:
         self.connection.commit()
+        self.run_commit_callbacks()
 
     def rollback(self) -> None:
         self.connection.rollback()
+        self.commit_callbacks.clear()
+
+
+class RetryPolicy:
+    '''
+    Bounded exponential backoff with full jitter for transactions that failed because the database was locked.
+    '''
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_retryable(exception: Exception) -> bool:
+        if not isinstance(exception, OperationalError):
+            return False
+
+        message = str(exception.orig).lower()
+
+        return 'database is locked' in message or 'database is busy' in message
+
+    def get_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        attempt = 0
+
+        while True:
+            try:
+                return await call()
+
+            except Exception as exception:
+                if not self.is_retryable(exception):
+                    raise exception
+
+                if attempt >= self.max_attempts:
+                    metrics.increment('db.retries_exhausted')
+                    raise exception
+
+                metrics.increment('db.retries')
+
+                await asyncio.sleep(self.get_delay(attempt))
+                attempt += 1
+
+
+database_unavailable_exception = HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Database unavailable.')
 
 
 class DatabaseManager:
     connection_class = DBConnection
-    last_connection_check_time = datetime.fromtimestamp(0)
     connection_check_retries = 5
+    is_healthy = True
+    is_tmp_db = False
+    retry_policy = RetryPolicy(
+        max_attempts=settings.DATABASE_RETRY_ATTEMPTS,
+        base_delay=settings.DATABASE_RETRY_BASE_DELAY_MS / 1_000,
+        max_delay=settings.DATABASE_RETRY_MAX_DELAY_MS / 1_000
+    )
     engine: Engine | None = None
+    read_engine: Engine | None = None
 
     def __new__(cls) -> 'DatabaseManager':
         if cls.engine is None:
@@ -63,19 +232,72 @@ class DatabaseManager:
                 cls._dispose_and_end_process()
             else:
                 cls._test_database()
+                cls._print_performance_pragmas()
+                cls.read_engine = cls._create_read_engine(cls.engine)
 
         return super().__new__(cls)
 
-    @classmethod
-    def _create_engine(cls) -> Engine | None:
-
-        url_parts = make_url(settings.DATABASE_URL)
-        is_tmp_db = (
+    @staticmethod
+    def _is_tmp_db(url_parts: URL) -> bool:
+        return (
             (not url_parts.database and not url_parts.host) or
             (':memory:' in (url_parts.database or '')) or
             (url_parts.query.get('mode') == 'memory')
         )
 
+    @staticmethod
+    def _is_local_sqlite(url_parts: URL) -> bool:
+        return url_parts.get_backend_name() == 'sqlite' and not url_parts.host
+
+    @staticmethod
+    def _get_performance_pragmas() -> dict[str, str | int]:
+        pragmas: dict[str, str | int] = {
+            'journal_mode': settings.DATABASE_JOURNAL_MODE.upper(),
+            'synchronous': settings.DATABASE_SYNCHRONOUS.upper(),
+            'mmap_size': settings.DATABASE_MMAP_SIZE,
+            'cache_size': settings.DATABASE_CACHE_SIZE,
+            'temp_store': settings.DATABASE_TEMP_STORE.upper(),
+            'busy_timeout': settings.DATABASE_BUSY_TIMEOUT,
+        }
+
+        for name, valid_values in PRAGMA_VALUES.items():
+            if pragmas[name] not in valid_values:
+                raise ValueError(f'Invalid value for PRAGMA {name}: {pragmas[name]}. Must be one of {valid_values}.')
+
+        return pragmas
+
+    @classmethod
+    def _set_performance_pragmas(cls, engine: Engine) -> None:
+        pragmas = cls._get_performance_pragmas()
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+            cursor = dbapi_connection.cursor()
+
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value};')
+
+            cursor.close()
+
+    @classmethod
+    def _print_performance_pragmas(cls) -> None:
+        if cls.engine is None or not cls._is_local_sqlite(cls.engine.url):
+            return
+
+        with cls.engine.connect() as conn:
+            effective_values = [
+                f'{name}={conn.exec_driver_sql(f"PRAGMA {name};").scalar()}'
+                for name in cls._get_performance_pragmas()
+            ]
+
+        print('SQLite pragmas:', ', '.join(effective_values))
+
+    @classmethod
+    def _create_engine(cls) -> Engine | None:
+
+        url_parts = make_url(settings.DATABASE_URL)
+        is_tmp_db = cls._is_tmp_db(url_parts)
+
         if not is_tmp_db and not url_parts.host and url_parts.database is not None:
             if not os.path.isfile(url_parts.database):
                 print(f'Error: {url_parts.database} does not exist.')
@@ -87,12 +309,43 @@ class DatabaseManager:
             poolclass=StaticPool if is_tmp_db else None
         )
 
+        if cls._is_local_sqlite(url_parts):
+            cls._set_performance_pragmas(engine)
+
+        cls.is_tmp_db = is_tmp_db
+
         if is_tmp_db:
             print('Using temporary database. Running migrations.')
             run_all_migrations(engine, echo=False)
 
         return engine
 
+    @classmethod
+    def _create_read_engine(cls, engine: Engine) -> Engine:
+        '''
+        Only file databases get their own read-only pool,
+        temporary databases live in a single connection and remote ones handle concurrency themselves.
+        '''
+        url_parts = make_url(settings.DATABASE_URL)
+
+        if cls._is_tmp_db(url_parts) or not cls._is_local_sqlite(url_parts):
+            return engine
+
+        read_engine = create_engine(
+            settings.DATABASE_URL,
+            connect_args={'check_same_thread': False}
+        )
+
+        cls._set_performance_pragmas(read_engine)
+
+        @event.listens_for(read_engine, 'connect')
+        def set_query_only(dbapi_connection: Any, connection_record: Any) -> None:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA query_only = ON;')
+            cursor.close()
+
+        return read_engine
+
     @classmethod
     def _test_database(cls) -> None:
         if cls.engine is None:
@@ -121,11 +374,19 @@ class DatabaseManager:
 
     @classmethod
     def _check_engine_connection(cls) -> bool:
-        if cls.engine is None:
-            raise Exception('Database not initialized.')
+        for _ in range(cls.connection_check_retries):
+            if cls._ping_engine():
+                return True
+
+            time.sleep(0.5)
+            cls._recreate_engine()
 
-        if cls.connection_check_retries <= 0:
-            print('Error: The maximum number of attempts was reached verifying the database connection.')
+        print('Error: The maximum number of attempts was reached verifying the database connection.')
+        return False
+
+    @classmethod
+    def _ping_engine(cls) -> bool:
+        if cls.engine is None:
             return False
 
         try:
@@ -138,18 +399,52 @@ class DatabaseManager:
             if settings.DEBUG:
                 print_exception(exception)
 
-            time.sleep(0.5)
-            cls.connection_check_retries -= 1
-            cls.engine.dispose()
-            cls.engine = cls._create_engine()
-            return cls._check_engine_connection()
+            return False
 
         return True
 
     @classmethod
-    def _dispose_and_end_process(cls) -> None:
+    def _recreate_engine(cls) -> None:
+        cls._dispose_engines()
+
+        cls.engine = cls._create_engine()
+        cls.read_engine = None if cls.engine is None else cls._create_read_engine(cls.engine)
+
+    @classmethod
+    def _dispose_engines(cls, close: bool = True) -> None:
+        if cls.read_engine is not None and cls.read_engine is not cls.engine:
+            cls.read_engine.dispose(close)
+
         if cls.engine is not None:
-            cls.engine.dispose()
+            cls.engine.dispose(close)
+
+    @classmethod
+    async def monitor_connection(cls) -> None:
+        '''
+        Checks the database connection in the background, so requests only read `is_healthy`.
+        Runs until cancelled or until the connection cannot be recovered.
+        '''
+        while True:
+            await asyncio.sleep(TIME_BETWEEN_CONNECTION_CHECKS.total_seconds())
+
+            for _ in range(cls.connection_check_retries):
+                if await to_thread.run_sync(cls._ping_engine):
+                    cls.is_healthy = True
+                    break
+
+                cls.is_healthy = False
+
+                await asyncio.sleep(0.5)
+                await to_thread.run_sync(cls._recreate_engine)
+
+            else:
+                print('Error: The maximum number of attempts was reached verifying the database connection.')
+                cls._dispose_and_end_process()
+                return
+
+    @classmethod
+    def _dispose_and_end_process(cls) -> None:
+        cls._dispose_engines()
 
         os.kill(os.getppid(), signal.SIGTERM)  # Aim uvicorn process
         os.kill(os.getpid(), signal.SIGTERM)
@@ -158,25 +453,43 @@ class DatabaseManager:
         if not self.engine:
             raise Exception('Database not initialized.')
 
-        self.engine.dispose(close)
+        self._dispose_engines(close)
+
+    async def run_with_retries(self, call: Callable[[], Awaitable[T]]) -> T:
+        '''
+        `connect` cannot re-run the body of its transaction, so callers that own the whole unit of work
+        (like `DatabaseRetryRoute`) use this to retry it from the start when the database is locked.
+        '''
+        return await self.retry_policy.run(call)
 
     @contextmanager
     def connect(self) -> Iterator[DBConnection]:
         if not self.engine:
             raise Exception('Database not initialized.')
 
-        now = datetime.now()
+        if not self.is_healthy:
+            raise database_unavailable_exception
 
-        if now > self.last_connection_check_time + TIME_BETWEEN_CONNECTION_CHECKS:
-            success = self._check_engine_connection()
+        with self.engine.begin() as conn:
+            db = self.connection_class(conn)
+            yield db
 
-            if not success:
-                self._dispose_and_end_process()
-                return
+        # Only reached when `begin` committed
+        db.run_commit_callbacks()
+
+    @contextmanager
+    def connect_read(self) -> Iterator[DBConnection]:
+        '''
+        Connection without an explicit transaction for read only queries,
+        so they do not wait for the write lock.
+        '''
+        if not self.read_engine:
+            raise Exception('Database not initialized.')
 
-            self.last_connection_check_time = now
+        if not self.is_healthy:
+            raise database_unavailable_exception
 
-        with self.engine.begin() as conn:
+        with self.read_engine.connect() as conn:
             yield self.connection_class(conn)
 
 
@@ -193,6 +506,7 @@ class TestDatabaseManager(DatabaseManager):
     def __new__(cls) -> 'TestDatabaseManager':
         if not cls.is_initialized:
             cls.engine = create_engine('sqlite+pysqlite:///:memory:', connect_args={"check_same_thread": False}, poolclass=StaticPool)
+            cls.read_engine = cls.engine
             cls.is_initialized = True
 
         return super(DatabaseManager, cls).__new__(cls)
@@ -206,8 +520,38 @@ def get_db_connection():
         yield conn
 
 
+class DatabaseRetryRoute(APIRoute):
+    '''
+    Retries the whole request, including the transaction opened by `get_db_connection`, when the database is locked.
+    The transaction is committed before the response is sent, so a failed commit is also retried.
+    '''
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        original_route_handler = super().get_route_handler()
+
+        async def retry_route_handler(request: Request) -> Response:
+            return await database_manager.run_with_retries(lambda: original_route_handler(request))
+
+        return retry_route_handler
+
+
+def get_read_db_connection():
+    with database_manager.connect_read() as conn:
+        yield conn
+
+
+def get_read_db_connector() -> Callable[[], AbstractContextManager[DBConnection]]:
+    '''
+    For responses that keep reading after the route returns (eg: streaming),
+    since dependency connections are closed before the response is sent.
+    '''
+    return database_manager.connect_read
+
+
 def get_db_engine() -> Engine | None:
     return database_manager.engine
 
 
 DBConnectionDep = Annotated[DBConnection, Depends(get_db_connection)]
+ReadDBConnectionDep = Annotated[DBConnection, Depends(get_read_db_connection)]
+ReadDBConnectorDep = Annotated[Callable[[], AbstractContextManager[DBConnection]], Depends(get_read_db_connector)]
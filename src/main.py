@@ -2,15 +2,54 @@ from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
 from typing import AsyncIterator
 from contextlib import asynccontextmanager
-from database import database_manager
+from anyio import to_thread
+from database import database_manager, statements
+from routers.times import rebuild_leaderboard, rebuild_rank_index, load_time_distributions, checkpoint_time_distributions
+from board_pool import board_pool, no_guess_board_pool
+from routers.auth import password_hasher
 import routers
 import settings
+import asyncio
+
+
+async def checkpoint_time_distributions_periodically() -> None:
+    while True:
+        await asyncio.sleep(settings.DISTRIBUTION_CHECKPOINT_MINUTES * 60)
+
+        try:
+            await to_thread.run_sync(checkpoint_time_distributions)
+        except Exception as exception:
+            print(f'Error: Could not checkpoint the time distributions. {exception}')
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Sync routes and their blocking DB calls run in this threadpool
+    to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+
+    statements.print_report()
+
+    await to_thread.run_sync(rebuild_leaderboard)
+    await to_thread.run_sync(rebuild_rank_index)
+    await to_thread.run_sync(load_time_distributions)
+
+    board_pool.start()
+    no_guess_board_pool.start()
+
+    connection_monitor = asyncio.create_task(database_manager.monitor_connection())
+    distributions_checkpointer = asyncio.create_task(checkpoint_time_distributions_periodically())
+
     yield
 
+    connection_monitor.cancel()
+    distributions_checkpointer.cancel()
+
+    await to_thread.run_sync(board_pool.stop)
+    await to_thread.run_sync(no_guess_board_pool.stop)
+    await to_thread.run_sync(password_hasher.shutdown)
+
+    await to_thread.run_sync(checkpoint_time_distributions)
+
     if database_manager.engine:
         database_manager.dispose()
 
@@ -46,6 +85,7 @@ app.include_router(routers.users, prefix='/api/users')
 app.include_router(routers.games, prefix='/api/games')
 app.include_router(routers.times, prefix='/api/timerecords')
 app.include_router(routers.game_settings, prefix='/api/settings')
+app.include_router(routers.metrics, prefix='/api/metrics')
 
 origins: list[str] = []
 
@@ -64,7 +104,9 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=['*'],
-    allow_headers=['*']
+    allow_headers=['*'],
+    # Read by the client to request the next page and to wait before retrying
+    expose_headers=['X-Next-Cursor', 'Retry-After']
 )
 
 
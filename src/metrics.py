@@ -0,0 +1,89 @@
+from typing import Any, Callable, Sequence
+from threading import Lock
+import bisect
+
+
+DEFAULT_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1_000, 2_500, 5_000)
+
+
+class Histogram:
+    '''
+    Fixed buckets histogram, each bucket counts the values lower or equal than its bound.
+    The last bucket counts everything above the highest bound.
+    '''
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                'count': self.count,
+                'total': self.total,
+                'mean': self.total / self.count if self.count else 0.0,
+                'max': self.max,
+                'buckets': {
+                    **{str(bound): count for bound, count in zip(self.buckets, self.counts)},
+                    'inf': self.counts[-1]
+                }
+            }
+
+
+class Metrics:
+    '''
+    In-process counters, histograms and gauges.
+    Names are dot separated, eg: `db.query.games.get_all.duration_ms`.
+    '''
+
+    def __init__(self) -> None:
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self.lock = Lock()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_counter(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def observe(self, name: str, value: float) -> None:
+        histogram = self.histograms.get(name)
+
+        if histogram is None:
+            histogram = self.histograms.setdefault(name, Histogram())
+
+        histogram.observe(value)
+
+    def register_gauge(self, name: str, callback: Callable[[], float]) -> None:
+        self.gauges[name] = callback
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            counters = dict(self.counters)
+
+        return {
+            'counters': counters,
+            'gauges': {name: callback() for name, callback in self.gauges.items()},
+            'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+        }
+
+
+metrics = Metrics()
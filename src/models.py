@@ -1,10 +1,29 @@
 from pydantic import BaseModel, ConfigDict
 from pydantic.alias_generators import to_camel
+from sqlalchemy import Row
+from typing import Any, TypeVar
+
+
+FromDBModelT = TypeVar('FromDBModelT', bound='FromDBModel')
 
 
 class FromDBModel(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
+    @classmethod
+    def from_row(cls: type[FromDBModelT], row: Row[Any]) -> FromDBModelT:
+        '''
+        Builds the model without validation.
+        Only for rows from our own schema, inputs must be validated.
+        '''
+        return cls.model_construct(**cls.get_row_fields(row))
+
+    @classmethod
+    def get_row_fields(cls, row: Row[Any]) -> dict[str, Any]:
+        values = row._mapping
+
+        return {name: values[name] for name in cls.model_fields if name in values}
+
 
 class CamelModel(BaseModel):
     model_config = ConfigDict(
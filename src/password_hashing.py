@@ -0,0 +1,120 @@
+from fastapi import HTTPException, status
+from concurrent.futures import Future, ProcessPoolExecutor
+from passlib.context import CryptContext
+from typing import Any, Callable, TypeVar
+from threading import Lock
+from metrics import metrics
+import multiprocessing
+import settings
+import time
+
+
+T = TypeVar('T')
+
+# Worker side, contexts by config so changes of the parent's context are picked up
+worker_contexts: dict[str, CryptContext] = {}
+
+
+def get_worker_context(config: str) -> CryptContext:
+    context = worker_contexts.get(config)
+
+    if context is None:
+        context = worker_contexts[config] = CryptContext.from_string(config)
+
+    return context
+
+
+def run_in_worker(function: Callable[..., T], *args: Any) -> tuple[T, float]:
+    '''
+    Returns the result and how long it took in milliseconds.
+    '''
+    start_time = time.perf_counter()
+    result = function(*args)
+
+    return result, (time.perf_counter() - start_time) * 1_000
+
+
+def hash_password(config: str, password: str) -> str:
+    return get_worker_context(config).hash(password)
+
+
+def verify_password(config: str, password: str, password_hash: str) -> bool:
+    return get_worker_context(config).verify(password, password_hash)
+
+
+def verify_and_update_password(config: str, password: str, password_hash: str) -> tuple[bool, str | None]:
+    return get_worker_context(config).verify_and_update(password, password_hash)
+
+
+password_queue_full_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail='Too many password requests, try again later.',
+    headers={'Retry-After': str(settings.PASSWORD_RETRY_AFTER_SECONDS)}
+)
+
+
+class PasswordHasher:
+    '''
+    Runs the `CryptContext` operations in a process pool, so bcrypt does not hold the GIL of the API process.
+    At most `max_queue_size` operations are queued or running, the rest are rejected with 503.
+    Sync routes block their thread on the result, which releases the GIL while waiting.
+
+    Metrics: `auth.password.{queue_wait_ms,hash_ms}` histograms, `auth.password.rejected` counter
+    and `auth.password.queue_size` gauge.
+    '''
+
+    def __init__(self, context: CryptContext, workers: int, max_queue_size: int):
+        self.context = context
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.queue_size = 0
+        self.executor: ProcessPoolExecutor | None = None
+        self.lock = Lock()
+
+        metrics.register_gauge('auth.password.queue_size', lambda: self.queue_size)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # Spawned workers do not inherit the threads and locks of the API process
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+        return self.executor
+
+    def _run(self, function: Callable[..., T], *args: Any) -> T:
+        with self.lock:
+            if self.queue_size >= self.max_queue_size:
+                metrics.increment('auth.password.rejected')
+                raise password_queue_full_exception
+
+            self.queue_size += 1
+            future: Future[tuple[T, float]] = self._get_executor().submit(run_in_worker, function, self.context.to_string(), *args)
+
+        start_time = time.perf_counter()
+
+        try:
+            result, hash_time = future.result()
+
+        finally:
+            with self.lock:
+                self.queue_size -= 1
+
+        metrics.observe('auth.password.hash_ms', hash_time)
+        metrics.observe('auth.password.queue_wait_ms', max((time.perf_counter() - start_time) * 1_000 - hash_time, 0))
+
+        return result
+
+    def hash(self, password: str) -> str:
+        return self._run(hash_password, password)
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        return self._run(verify_password, password, password_hash)
+
+    def verify_and_update(self, password: str, password_hash: str) -> tuple[bool, str | None]:
+        return self._run(verify_and_update_password, password, password_hash)
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor, self.executor = self.executor, None
+
+        if executor is not None:
+            executor.shutdown()
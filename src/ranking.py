@@ -0,0 +1,87 @@
+from typing import Iterable
+from threading import Lock
+import bisect
+
+
+class RankIndex:
+    '''
+    Best time of every user per difficulty, kept sorted in memory,
+    so rank and percentile queries are binary searches (O(log n)).
+
+    It is rebuilt from `time_records` at startup and updated once the writes that save or delete records are committed.
+    '''
+
+    def __init__(self) -> None:
+        self.best_times: dict[int, dict[int, int]] = {}
+        self.sorted_times: dict[int, list[int]] = {}
+        self.lock = Lock()
+
+    def rebuild(self, best_times: Iterable[tuple[int, int, int]]) -> None:
+        '''
+        Replaces the index with (difficulty, user_id, best_time) tuples.
+        '''
+        new_best_times: dict[int, dict[int, int]] = {}
+
+        for difficulty, user_id, best_time in best_times:
+            new_best_times.setdefault(difficulty, {})[user_id] = best_time
+
+        new_sorted_times = {
+            difficulty: sorted(users.values())
+            for difficulty, users in new_best_times.items()
+        }
+
+        with self.lock:
+            self.best_times = new_best_times
+            self.sorted_times = new_sorted_times
+
+    def set_best_time(self, difficulty: int, user_id: int, best_time: int | None) -> None:
+        '''
+        `None` removes the user from the difficulty.
+        '''
+        with self.lock:
+            self._set_best_time(difficulty, user_id, best_time)
+
+    def _set_best_time(self, difficulty: int, user_id: int, best_time: int | None) -> None:
+        '''
+        Callers must hold the lock.
+        '''
+        users = self.best_times.setdefault(difficulty, {})
+        times = self.sorted_times.setdefault(difficulty, [])
+
+        previous_best_time = users.pop(user_id, None)
+
+        if previous_best_time is not None:
+            del times[bisect.bisect_left(times, previous_best_time)]
+
+        if best_time is not None:
+            users[user_id] = best_time
+            bisect.insort(times, best_time)
+
+    def add_time(self, difficulty: int, user_id: int, time: int) -> None:
+        '''
+        Compared and set under the same lock, so concurrent saves of a user cannot replace a better time.
+        '''
+        with self.lock:
+            best_time = self.best_times.get(difficulty, {}).get(user_id)
+
+            if best_time is None or time < best_time:
+                self._set_best_time(difficulty, user_id, time)
+
+    def get_best_time(self, difficulty: int, user_id: int) -> int | None:
+        with self.lock:
+            return self.best_times.get(difficulty, {}).get(user_id)
+
+    def get_rank(self, difficulty: int, time: int) -> tuple[int, int, int]:
+        '''
+        Returns the rank the time would have, the number of players and how many of them are slower.
+        '''
+        with self.lock:
+            times = self.sorted_times.get(difficulty, [])
+
+            rank = bisect.bisect_left(times, time) + 1
+            slower_players = len(times) - bisect.bisect_right(times, time)
+
+            return rank, len(times), slower_players
+
+
+rank_index = RankIndex()
@@ -0,0 +1,110 @@
+from fastapi import HTTPException, Request, status
+from collections import OrderedDict
+from threading import Lock
+from metrics import metrics
+import settings
+import math
+import time
+import zlib
+
+
+SHARDS = 16
+
+# (tokens, updated_at)
+Bucket = tuple[float, float]
+
+
+class RateLimiter:
+    '''
+    Token buckets by key, with `capacity` tokens (the burst) refilled at `refill_per_minute`.
+    The buckets are split in shards with their own lock, so requests with different keys rarely wait for each other.
+    Each shard keeps its `max_keys / SHARDS` most recently used buckets, the rest start full again.
+
+    Metrics: `rate_limit.{name}.rejected` counter.
+    '''
+
+    def __init__(self, name: str, capacity: int, refill_per_minute: int, max_keys: int):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_minute / 60
+        self.max_keys_per_shard = max(max_keys // SHARDS, 1)
+        self.shards: list[tuple[Lock, OrderedDict[str, Bucket]]] = [(Lock(), OrderedDict()) for _ in range(SHARDS)]
+
+    def acquire(self, key: str) -> float:
+        '''
+        Takes a token from the bucket of `key`.
+        Returns 0 if it had one, otherwise the seconds until it has.
+        '''
+        if self.capacity <= 0:
+            return 0
+
+        # Stable across processes, unlike `hash`
+        lock, buckets = self.shards[zlib.crc32(key.encode()) % SHARDS]
+        now = time.monotonic()
+
+        with lock:
+            tokens, updated_at = buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.refill_per_second)
+
+            if tokens >= 1:
+                buckets[key] = (tokens - 1, now)
+                buckets.move_to_end(key)
+
+                if len(buckets) > self.max_keys_per_shard:
+                    buckets.popitem(last=False)
+
+                return 0
+
+            buckets[key] = (tokens, now)
+            buckets.move_to_end(key)
+
+        metrics.increment(f'rate_limit.{self.name}.rejected')
+
+        if self.refill_per_second <= 0:
+            return math.inf
+
+        return (1 - tokens) / self.refill_per_second
+
+    def check(self, key: str) -> None:
+        '''
+        Raises `429` with `Retry-After` when the bucket of `key` is empty.
+        '''
+        wait_time = self.acquire(key)
+
+        if not wait_time:
+            return
+
+        retry_after = str(math.ceil(wait_time)) if math.isfinite(wait_time) else '3600'
+
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail='Too many requests, try again later.',
+            headers={'Retry-After': retry_after}
+        )
+
+    def clear(self) -> None:
+        for lock, buckets in self.shards:
+            with lock:
+                buckets.clear()
+
+
+ip_rate_limiter = RateLimiter(
+    'ip',
+    settings.RATE_LIMIT_IP_BURST,
+    settings.RATE_LIMIT_IP_PER_MINUTE,
+    settings.RATE_LIMIT_MAX_KEYS
+)
+username_rate_limiter = RateLimiter(
+    'username',
+    settings.RATE_LIMIT_USERNAME_BURST,
+    settings.RATE_LIMIT_USERNAME_PER_MINUTE,
+    settings.RATE_LIMIT_MAX_KEYS
+)
+
+
+def limit_by_ip(request: Request) -> None:
+    '''
+    Dependency, every route has its own buckets (by endpoint, so path parameters cannot be used to get new ones).
+    '''
+    host = request.client.host if request.client is not None else ''
+    ip_rate_limiter.check(f'{request.scope["endpoint"].__name__}:{host}')
@@ -5,3 +5,4 @@ from .auth import router as auth
 from .games import router as games
 from .times import router as times
 from .game_settings import router as game_settings
+from .metrics import router as metrics
@@ -1,20 +1,25 @@
 from fastapi import APIRouter, Body, HTTPException, status, Depends, Query, Request, Response, Path
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.routing import APIRoute
 from pydantic import field_validator, Field, ValidationError
 from passlib.context import CryptContext
 from passlib.pwd import genword  # type: ignore
 from jose import jwt, JWTError
 from typing import Annotated, Any, Callable, Coroutine, Literal
 from models import User, FromDBModel, CamelModel
-from database import DBConnectionDep, DBConnection
+from database import DBConnectionDep, DBConnection, DatabaseRetryRoute, statements
 from utils import print_exception, get_json_error_resonse
+from token_cache import token_cache
+from session_cache import SessionState, session_cache
+from metrics import metrics
+from password_hashing import PasswordHasher
+from rate_limiting import limit_by_ip, username_rate_limiter
 import settings
 from datetime import datetime, timedelta, timezone
 import re
 
 
 password_context = CryptContext(schemes=['bcrypt'])
+password_hasher = PasswordHasher(password_context, settings.PASSWORD_WORKERS, settings.PASSWORD_QUEUE_SIZE)
 
 
 class Credentials(CamelModel):
@@ -139,6 +144,83 @@ class DecodedRefreshToken(FromDBModel):
     claims: RefreshTokenClaims
 
 
+statements.register(
+    'auth.get_session',
+    'SELECT token_id, family_id, is_invalidated '
+    'FROM auth '
+    'WHERE user_id = :user_id AND device_id = :device_id;'
+)
+statements.register(
+    'auth.get_last_device_id',
+    'SELECT MAX(device_id) as last_device_id '
+    'FROM auth '
+    'WHERE user_id = :user_id;'
+)
+statements.register(
+    'auth.get_family_id',
+    'SELECT family_id '
+    'FROM auth '
+    'WHERE user_id = :user_id AND device_id = :device_id;'
+)
+statements.register(
+    'auth.insert_session',
+    'INSERT INTO auth (user_id, token_id, family_id, device_id, is_invalidated) '
+    'VALUES (:user_id, 0, :family_id, :device_id, FALSE);'
+)
+statements.register(
+    'auth.reset_session',
+    'UPDATE auth '
+    'SET token_id = 0, '
+    '    family_id = :family_id, '
+    '    is_invalidated = FALSE '
+    'WHERE user_id = :user_id AND device_id = :device_id;'
+)
+statements.register(
+    'auth.rotate_token_id',
+    'UPDATE auth '
+    'SET token_id = token_id + 1 '
+    'WHERE user_id = :user_id AND device_id = :device_id AND token_id = :token_id AND family_id = :family_id AND NOT is_invalidated '
+    'RETURNING token_id;'
+)
+statements.register(
+    'auth.invalidate_session',
+    'UPDATE auth '
+    'SET is_invalidated = TRUE '
+    'WHERE user_id = :user_id AND device_id = :device_id;'
+)
+statements.register(
+    'auth.get_user_credentials',
+    'SELECT id, password_hash '
+    'FROM users '
+    'WHERE username = :username;'
+)
+statements.register(
+    'auth.get_user_id',
+    'SELECT id '
+    'FROM users '
+    'WHERE username = :username;'
+)
+statements.register(
+    'auth.insert_user',
+    'INSERT INTO users (username, password_hash) '
+    'VALUES (:username, :password_hash);'
+)
+statements.register(
+    'auth.update_password_hash',
+    'UPDATE users '
+    'SET password_hash = :password_hash '
+    'WHERE id = :id;'
+)
+statements.register(
+    'auth.get_test_usernames',
+    'SELECT username '
+    'FROM users '
+    # Prefix range, so it can use the index. Unlike LIKE it is case sensitive,
+    # which does not matter since only generated usernames can have '#'
+    "WHERE username >= '#testaccount' AND username < '#testaccounu';"
+)
+
+
 def decode_token(token: str) -> dict[str, Any] | None:
     try:
         return jwt.decode(token, key=settings.SECRET_KEY, algorithms=settings.JWT_ALGORITHM)
@@ -155,7 +237,26 @@ def encode_token(claims: dict[str, Any]) -> str | None:
         return None
 
 
+def cache_session_state(db: DBConnection, user_id: int, device_id: int, state: SessionState | None) -> None:
+    '''
+    Write-through of `session_cache`: the entry is dropped right away and replaced by `state` once the transaction commits,
+    so rolled back changes are never cached. With `None` it is only dropped.
+    '''
+    key = (user_id, device_id)
+    session_cache.pop(key)
+
+    if state is None:
+        db.on_commit(lambda: session_cache.pop(key))
+    else:
+        db.on_commit(lambda: session_cache.put(key, state))
+
+
 def refresh_tokens_(db: DBConnection, refresh_token: str) -> tuple[Tokens | None, str]:
+    '''
+    The token id is rotated with a single compare-and-swap UPDATE,
+    the session is only read to find out why when it does not match.
+    Tokens of invalidated or replaced families are rejected by `session_cache` without touching the database.
+    '''
     refresh_token_claims = decode_token(refresh_token)
 
     if refresh_token_claims is None:
@@ -166,37 +267,20 @@ def refresh_tokens_(db: DBConnection, refresh_token: str) -> tuple[Tokens | None
 
     user_id = int(refresh_token_claims['sub'])
     device_id: int = refresh_token_claims['device_id']
+    family_id: int = refresh_token_claims['family_id']
+    token_id: int = refresh_token_claims['token_id']
 
-    row = db.fetch_one(
-        'SELECT token_id, family_id, is_invalidated '
-        'FROM auth '
-        'WHERE user_id = :user_id AND device_id = :device_id;',
-        {'user_id': user_id, 'device_id': device_id}
-    )
+    cached_state = session_cache.get((user_id, device_id))
 
-    if row is None:
-        return None, 'Could not get token claims from DB.'
-
-    if row.is_invalidated:
-        return None, 'Refresh token is invalidated.'
-
-    token_id: int = row.token_id
-    family_id: int = row.family_id
-
-    if family_id == refresh_token_claims['family_id'] and token_id != refresh_token_claims['token_id']:
-        db.execute(
-            'UPDATE auth '
-            'SET is_invalidated = TRUE '
-            'WHERE user_id = :user_id AND device_id = :device_id;',
-            {'user_id': user_id, 'device_id': device_id},
-        )
+    # Newer families are left to the database, the entry may be outdated
+    if cached_state is not None and family_id <= cached_state.family_id:
+        if family_id < cached_state.family_id:
+            metrics.increment('auth.session_cache.rejected_refreshes')
+            return None, 'Token family ID does not match.'
 
-        return None, 'Old token ID.'
-
-    if family_id != refresh_token_claims['family_id']:
-        return None, 'Token family ID does not match.'
-
-    token_id += 1
+        if cached_state.is_invalidated:
+            metrics.increment('auth.session_cache.rejected_refreshes')
+            return None, 'Refresh token is invalidated.'
 
     new_access_token = encode_token({
         'sub': str(user_id),
@@ -206,7 +290,7 @@ def refresh_tokens_(db: DBConnection, refresh_token: str) -> tuple[Tokens | None
 
     new_refresh_token = encode_token({
         'sub': str(user_id),
-        'token_id': token_id,
+        'token_id': token_id + 1,
         'family_id': family_id,
         'device_id': device_id,
         'type': 'refresh',
@@ -216,14 +300,41 @@ def refresh_tokens_(db: DBConnection, refresh_token: str) -> tuple[Tokens | None
     if new_access_token is None or new_refresh_token is None:
         return None, 'Could not generated access or/and refresh token/s.'
 
+    row = db.fetch_one(
+        'auth.rotate_token_id',
+        {'user_id': user_id, 'device_id': device_id, 'token_id': token_id, 'family_id': family_id}
+    )
+
+    if row is not None:
+        cache_session_state(db, user_id, device_id, SessionState(row.token_id, family_id, False))
+
+        return Tokens(access_token=new_access_token, refresh_token=new_refresh_token, device_id=device_id), ''
+
+    row = db.fetch_one(
+        'auth.get_session',
+        {'user_id': user_id, 'device_id': device_id}
+    )
+
+    if row is None:
+        return None, 'Could not get token claims from DB.'
+
+    if row.is_invalidated or row.family_id != family_id:
+        cache_session_state(db, user_id, device_id, SessionState(row.token_id, row.family_id, bool(row.is_invalidated)))
+
+        if row.is_invalidated:
+            return None, 'Refresh token is invalidated.'
+
+        return None, 'Token family ID does not match.'
+
+    # Reused token of the current family
     db.execute(
-        'UPDATE auth '
-        'SET token_id = :token_id '
-        'WHERE user_id = :user_id AND device_id = :device_id;',
-        {'token_id': token_id, 'user_id': user_id, 'device_id': device_id},
+        'auth.invalidate_session',
+        {'user_id': user_id, 'device_id': device_id},
     )
 
-    return Tokens(access_token=new_access_token, refresh_token=new_refresh_token, device_id=device_id), ''
+    cache_session_state(db, user_id, device_id, SessionState(row.token_id, row.family_id, True))
+
+    return None, 'Old token ID.'
 
 
 def generate_tokens_(db: DBConnection, user_id: int, device_id: int | None = None) -> tuple[Tokens | None, str]:
@@ -232,9 +343,7 @@ def generate_tokens_(db: DBConnection, user_id: int, device_id: int | None = Non
 
     if device_id is None:
         row = db.fetch_one(
-            'SELECT MAX(device_id) as last_device_id '
-            'FROM auth '
-            'WHERE user_id = :user_id;',
+            'auth.get_last_device_id',
             {'user_id': user_id}
         )
 
@@ -245,9 +354,7 @@ def generate_tokens_(db: DBConnection, user_id: int, device_id: int | None = Non
 
     else:
         row = db.fetch_one(
-            'SELECT family_id '
-            'FROM auth '
-            'WHERE user_id = :user_id AND device_id = :device_id;',
+            'auth.get_family_id',
             {'user_id': user_id, 'device_id': device_id}
         )
 
@@ -277,8 +384,7 @@ def generate_tokens_(db: DBConnection, user_id: int, device_id: int | None = Non
 
     if is_first_login:
         db.execute(
-            'INSERT INTO auth (user_id, token_id, family_id, device_id, is_invalidated) '
-            'VALUES (:user_id, 0, :family_id, :device_id, FALSE);',
+            'auth.insert_session',
             {
                 'user_id': user_id,
                 'family_id': family_id,
@@ -288,11 +394,7 @@ def generate_tokens_(db: DBConnection, user_id: int, device_id: int | None = Non
 
     else:
         db.execute(
-            'UPDATE auth '
-            'SET token_id = 0, '
-            '    family_id = :family_id, '
-            '    is_invalidated = FALSE '
-            'WHERE user_id = :user_id AND device_id = :device_id;',
+            'auth.reset_session',
             {
                 'family_id': family_id,
                 'user_id': user_id,
@@ -300,21 +402,21 @@ def generate_tokens_(db: DBConnection, user_id: int, device_id: int | None = Non
             },
         )
 
+    cache_session_state(db, user_id, device_id, SessionState(0, family_id, False))
+
     return Tokens(access_token=new_access_token, refresh_token=new_refresh_token, device_id=device_id), ''
 
 
 def get_db_user(db: DBConnection, username: str) -> DBUser | None:
     row = db.fetch_one(
-        'SELECT id, password_hash '
-        'FROM users '
-        'WHERE username = :username;',
+        'auth.get_user_credentials',
         {'username': username}
     )
 
     if row is None:
         return None
 
-    return DBUser.model_validate(row)
+    return DBUser.from_row(row)
 
 
 class UnauthorizedException(HTTPException):
@@ -350,20 +452,33 @@ AuthenticatedRefreshToken = Annotated[DecodedRefreshToken, Depends(authenticate_
 
 
 def authenticate_user(authorization_header: Annotated[HTTPAuthorizationCredentials, Depends(get_access_token)]) -> int:
-    access_token_claims = decode_token(authorization_header.credentials)
+    '''
+    Verified tokens are cached until they expire, so clients reusing their access token skip the JWT verification.
+    '''
+    access_token = authorization_header.credentials
+
+    user_id = token_cache.get(access_token)
+
+    if user_id is not None:
+        return user_id
+
+    access_token_claims = decode_token(access_token)
 
     if access_token_claims is None:
         raise UnauthorizedException('Could not decode access token.')
 
     try:
-        AccessTokenClaims.model_validate(access_token_claims)
+        claims = AccessTokenClaims.model_validate(access_token_claims)
     except ValidationError:
         raise UnauthorizedException('Could not validate access token claims.')
 
-    return int(access_token_claims['sub'])
+    user_id = int(claims.sub)
+    token_cache.put(access_token, user_id, claims.exp)
+
+    return user_id
 
 
-class RouteErrorHandler(APIRoute):
+class RouteErrorHandler(DatabaseRetryRoute):
     def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
         original_route_handler = super().get_route_handler()
 
@@ -393,14 +508,12 @@ username_in_use_exception = HTTPException(
 router = APIRouter(tags=['Authentication'], route_class=RouteErrorHandler)
 
 
-@router.post('/signup', response_model=User, status_code=status.HTTP_201_CREATED, responses={
+@router.post('/signup', response_model=User, status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_by_ip)], responses={
     status.HTTP_409_CONFLICT: get_json_error_resonse(example={'detail': username_in_use_exception.detail})
 })
 def register_user(credentials: Annotated[SignUpCredentials, Body()], db: DBConnectionDep) -> User:
     row = db.fetch_one(
-        'SELECT id '
-        'FROM users '
-        'WHERE username = :username;',
+        'auth.get_user_id',
         credentials.model_dump()
     )
 
@@ -409,19 +522,18 @@ def register_user(credentials: Annotated[SignUpCredentials, Body()], db: DBConne
 
     user = {
         "username": credentials.username,
-        "password_hash": password_context.hash(credentials.password)
+        "password_hash": password_hasher.hash(credentials.password)
     }
 
     db.execute(
-        'INSERT INTO users (username, password_hash) '
-        'VALUES (:username, :password_hash);',
+        'auth.insert_user',
         user,
     )
 
     return User(**user)
 
 
-@router.post('/tokens', response_model=Tokens)
+@router.post('/tokens', response_model=Tokens, dependencies=[Depends(limit_by_ip)])
 def generate_tokens(
     credentials: Annotated[Credentials, Body()],
     db: DBConnectionDep,
@@ -430,12 +542,14 @@ def generate_tokens(
         'Include this ID to avoid creating a new branch of RefreshTokens.'
     ))] = None
 ) -> Tokens:
+    username_rate_limiter.check(credentials.username)
+
     db_user = get_db_user(db, credentials.username)
 
     if db_user is None:
         raise UnauthorizedException('Could not get user from DB.')
 
-    is_verified, new_password_hash = password_context.verify_and_update(credentials.password, db_user.password_hash)
+    is_verified, new_password_hash = password_hasher.verify_and_update(credentials.password, db_user.password_hash)
 
     if not is_verified:
         raise UnauthorizedException('Passwords do not match.')
@@ -444,9 +558,7 @@ def generate_tokens(
         db_user.password_hash = new_password_hash
 
         db.execute(
-            'UPDATE users '
-            'SET password_hash = :password_hash '
-            'WHERE id = :id;',
+            'auth.update_password_hash',
             db_user.model_dump(),
         )
 
@@ -480,47 +592,48 @@ def logout(decoded_refresh_token: AuthenticatedRefreshToken, db: DBConnectionDep
     '''
     Invalidate a session (refresh token family).
     '''
+    user_id = int(decoded_refresh_token.claims.sub)
+    device_id = decoded_refresh_token.claims.device_id
+
     db.execute(
-        'UPDATE auth '
-        'SET is_invalidated = TRUE '
-        'WHERE user_id = :user_id AND device_id = :device_id;',
-        {'user_id': int(decoded_refresh_token.claims.sub), 'device_id': decoded_refresh_token.claims.device_id},
+        'auth.invalidate_session',
+        {'user_id': user_id, 'device_id': device_id},
     )
 
+    cache_session_state(db, user_id, device_id, None)
 
-@router.post('/logout/{device_id}', status_code=status.HTTP_204_NO_CONTENT)
+
+@router.post('/logout/{device_id}', status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(limit_by_ip)])
 def logout_device(credentials: Annotated[Credentials, Body()], device_id: Annotated[int, Path()], db: DBConnectionDep) -> None:
     '''
     Invalidate a session (device id) with credentials. Specially used for logout test accounts.
     '''
+    username_rate_limiter.check(credentials.username)
+
     db_user = get_db_user(db, credentials.username)
 
     if db_user is None:
         raise UnauthorizedException('Could not get user from DB.')
 
-    if not password_context.verify(credentials.password, db_user.password_hash):
+    if not password_hasher.verify(credentials.password, db_user.password_hash):
         raise UnauthorizedException('Passwords do not match.')
 
     db.execute(
-        'UPDATE auth '
-        'SET is_invalidated = TRUE '
-        'WHERE user_id = :user_id AND device_id = :device_id;',
+        'auth.invalidate_session',
         {'user_id': db_user.id, 'device_id': device_id},
     )
 
+    cache_session_state(db, db_user.id, device_id, None)
 
-@router.post('/testaccount', response_model=Credentials, status_code=status.HTTP_201_CREATED)
+
+@router.post('/testaccount', response_model=Credentials, status_code=status.HTTP_201_CREATED, dependencies=[Depends(limit_by_ip)])
 def generate_test_account(db: DBConnectionDep) -> Credentials:
     '''
     Generates a new test user for accessing protected endpoints without the need for signup.
     '''
     new_test_number = 0
 
-    rows = db.fetch_many(
-        'SELECT username '
-        'FROM users '
-        'WHERE username LIKE "#testaccount%";'
-    )
+    rows = db.fetch_many('auth.get_test_usernames')
 
     if rows:
         numbers_pattern = re.compile(r'\d+')
@@ -533,11 +646,10 @@ def generate_test_account(db: DBConnectionDep) -> Credentials:
     new_credentials = Credentials(username=f'#testaccount{new_test_number}', password=genword(length=20))  # type: ignore
 
     db.execute(
-        'INSERT INTO users (username, password_hash) '
-        'VALUES (:username, :password_hash);',
+        'auth.insert_user',
         {
             'username': new_credentials.username,
-            'password_hash': password_context.hash(new_credentials.password)
+            'password_hash': password_hasher.hash(new_credentials.password)
         },
     )
 
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, status, Body, Response
 from pydantic import Field
-from database import DBConnectionDep, DBConnection
-from typing import Annotated, Literal
+from database import DBConnectionDep, ReadDBConnectionDep, DBConnection, DatabaseRetryRoute, statements
+from sqlalchemy import Row
+from typing import Annotated, Literal, Any
 from models import FromDBModel, CamelModel
 from .auth import AuthenticatedUserID
 from utils import get_json_error_resonse
@@ -18,51 +19,81 @@ class GameSettings(FromDBModel, CamelModel):
     vibration_intensity: Annotated[int, Field(ge=0, description='Time in milliseconds.')]
     modified_at: int
 
+    @classmethod
+    def from_row(cls, row: Row[Any]) -> 'GameSettings':
+        fields = cls.get_row_fields(row)
+
+        # SQLite returns booleans as integers
+        for name in ('initial_zoom', 'action_toggle', 'easy_digging', 'vibration'):
+            fields[name] = bool(fields[name])
+
+        return cls.model_construct(**fields)
+
+
+statements.register(
+    'settings.insert',
+    'INSERT INTO game_settings ('
+    '    user_id, theme, initial_zoom, action_toggle, default_action, '
+    '    long_tap_delay, easy_digging, vibration, vibration_intensity, modified_at'
+    ') '
+    'VALUES ('
+    '    :user_id, :theme, :initial_zoom, :action_toggle, :default_action, '
+    '    :long_tap_delay, :easy_digging, :vibration, :vibration_intensity, :modified_at'
+    ');'
+)
+statements.register(
+    'settings.update',
+    'UPDATE game_settings '
+    'SET modified_at = :modified_at, theme = :theme, initial_zoom = :initial_zoom, '
+    '    action_toggle = :action_toggle, default_action = :default_action, '
+    '    long_tap_delay = :long_tap_delay, easy_digging = :easy_digging, '
+    '    vibration = :vibration, vibration_intensity = :vibration_intensity '
+    'WHERE id = :game_settings_id;'
+)
+statements.register(
+    'settings.get',
+    'SELECT * '
+    'FROM game_settings '
+    'WHERE user_id = :user_id;'
+)
+statements.register(
+    'settings.get_version',
+    'SELECT id, modified_at '
+    'FROM game_settings '
+    'WHERE user_id = :user_id;'
+)
+
 
 def save_game_settings(db: DBConnection, user_id: int, game_settings: GameSettings) -> None:
     db.execute(
-        'INSERT INTO game_settings ('
-        '    user_id, theme, initial_zoom, action_toggle, default_action, '
-        '    long_tap_delay, easy_digging, vibration, vibration_intensity, modified_at'
-        ') '
-        'VALUES ('
-        '    :user_id, :theme, :initial_zoom, :action_toggle, :default_action, '
-        '    :long_tap_delay, :easy_digging, :vibration, :vibration_intensity, :modified_at'
-        ');',
+        'settings.insert',
         {**game_settings.model_dump(), 'user_id': user_id},
     )
 
 
 def update_game_settings(db: DBConnection, game_settings_id: int, game_settings: GameSettings) -> None:
     db.execute(
-        'UPDATE game_settings '
-        'SET modified_at = :modified_at, theme = :theme, initial_zoom = :initial_zoom, '
-        '    action_toggle = :action_toggle, default_action = :default_action, '
-        '    long_tap_delay = :long_tap_delay, easy_digging = :easy_digging, '
-        '    vibration = :vibration, vibration_intensity = :vibration_intensity '
-        'WHERE id = :game_settings_id;',
+        'settings.update',
         {**game_settings.model_dump(), 'game_settings_id': game_settings_id},
     )
 
 
 def get_game_settings_(db: DBConnection, user_id: int) -> GameSettings | None:
     row = db.fetch_one(
-        'SELECT * '
-        'FROM game_settings '
-        'WHERE user_id = :user_id;',
+        'settings.get',
         {'user_id': user_id}
     )
 
     if row is None:
         return None
 
-    return GameSettings.model_validate(row)
+    return GameSettings.from_row(row)
 
 
 not_found_exception = HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 there_is_newer_version_exception = HTTPException(status_code=status.HTTP_409_CONFLICT, detail='There is a newer version.')
 
-router = APIRouter(tags=['Game Settings'])
+router = APIRouter(tags=['Game Settings'], route_class=DatabaseRetryRoute)
 
 
 @router.put('', response_model=GameSettings, responses={status.HTTP_409_CONFLICT: get_json_error_resonse('Already a Newer Version')})
@@ -72,9 +103,7 @@ def save_settings(user_id: AuthenticatedUserID, game_settings: Annotated[GameSet
     Otherwise, it will result in an error (409).
     '''
     row = db.fetch_one(
-        'SELECT id, modified_at '
-        'FROM game_settings '
-        'WHERE user_id = :user_id;',
+        'settings.get_version',
         {'user_id': user_id}
     )
 
@@ -95,7 +124,7 @@ def save_settings(user_id: AuthenticatedUserID, game_settings: Annotated[GameSet
 
 
 @router.get('', response_model=GameSettings, responses={status.HTTP_404_NOT_FOUND: get_json_error_resonse()})
-def get_game_settings(user_id: AuthenticatedUserID, db: DBConnectionDep) -> GameSettings:
+def get_game_settings(user_id: AuthenticatedUserID, db: ReadDBConnectionDep) -> GameSettings:
     game_settings = get_game_settings_(db, user_id)
 
     if game_settings is None:
@@ -1,16 +1,117 @@
-from fastapi import APIRouter, HTTPException, status, Body, Response, Path
-from database import DBConnectionDep, DBConnection
-from typing import Annotated, Sequence
+from fastapi import APIRouter, HTTPException, status, Body, Response, Path, Query
+from database import DBConnectionDep, ReadDBConnectionDep, DBConnection, DatabaseRetryRoute, statements
+from pydantic import Field
+from typing import Annotated, Any, Sequence
+from sqlalchemy import Row
 from models import FromDBModel, CamelModel
 from routers.auth import AuthenticatedUserID
 from utils import get_json_error_resonse
+from compression import compress_text, decompress_text, register_compression_ratio_gauge
+from boards import DIFFICULTIES, generate_game
+from board_pool import board_pool, no_guess_board_pool
+import settings
+import hashlib
+import secrets
 
 
 class Game(FromDBModel, CamelModel):
     difficulty: int
-    encoded_game: str
+    encoded_game: str = Field(max_length=settings.MAX_ENCODED_GAME_LENGTH)
     created_at: float
 
+    @classmethod
+    def from_row(cls, row: Row[Any]) -> 'Game':
+        fields = cls.get_row_fields(row)
+
+        # Stored compressed
+        fields['encoded_game'] = decompress_text(fields['encoded_game'])
+
+        return cls.model_construct(**fields)
+
+
+MAX_GAME_CHANGES = 1_000
+
+
+class GameChange(CamelModel):
+    '''
+    Replaces `encoded_game[start:end]` with `value`.
+    '''
+    start: int = Field(ge=0)
+    end: int = Field(ge=0)
+    value: str = Field(max_length=settings.MAX_ENCODED_GAME_LENGTH)
+
+
+class GamePatch(CamelModel):
+    base_created_at: float
+    base_hash: str | None = Field(default=None, description='SHA-256 (hex) of the base `encoded_game`.')
+    created_at: float
+    changes: list[GameChange] = Field(max_length=MAX_GAME_CHANGES)
+
+
+class GameVersion(CamelModel):
+    created_at: float
+    hash: str
+
+
+class NewGame(CamelModel):
+    difficulty: int
+    encoded_game: str = Field(description='One digit per cell (row-major) with its flags: 1 mine, 2 revealed, 4 flagged.')
+    seed: int
+
+
+ENCODED_GAME_METRIC = 'games.encoded_game'
+
+register_compression_ratio_gauge(ENCODED_GAME_METRIC)
+
+
+statements.register(
+    'games.insert',
+    'INSERT INTO games (user_id, difficulty, encoded_game, created_at) '
+    'VALUES (:user_id, :difficulty, :encoded_game, :created_at);'
+)
+statements.register(
+    'games.update',
+    'UPDATE games '
+    'SET difficulty = :difficulty, encoded_game = :encoded_game, created_at = :created_at '
+    'WHERE id = :game_id;'
+)
+statements.register(
+    'games.update_version',
+    'UPDATE games '
+    'SET encoded_game = :encoded_game, created_at = :created_at '
+    'WHERE id = :game_id AND created_at = :base_created_at '
+    'RETURNING id;'
+)
+statements.register(
+    'games.get_all',
+    'SELECT difficulty, encoded_game, created_at '
+    'FROM games '
+    'WHERE user_id = :user_id;'
+)
+statements.register(
+    'games.get',
+    'SELECT id, encoded_game, created_at '
+    'FROM games '
+    'WHERE user_id = :user_id AND difficulty = :difficulty;'
+)
+statements.register(
+    'games.get_version',
+    'SELECT id, created_at '
+    'FROM games '
+    'WHERE user_id = :user_id AND difficulty = :difficulty;'
+)
+statements.register(
+    'games.get_versions',
+    'SELECT id, difficulty, created_at '
+    'FROM games '
+    'WHERE user_id = :user_id;'
+)
+statements.register(
+    'games.delete',
+    'DELETE FROM games '
+    'WHERE user_id = :user_id AND difficulty = :difficulty;'
+)
+
 
 def save_games_(db: DBConnection, user_id: int, games: Game | Sequence[Game]) -> None:
     if not isinstance(games, Sequence):
@@ -20,10 +121,9 @@ def save_games_(db: DBConnection, user_id: int, games: Game | Sequence[Game]) ->
         return
 
     db.execute(
-        'INSERT INTO games (user_id, difficulty, encoded_game, created_at) '
-        'VALUES (:user_id, :difficulty, :encoded_game, :created_at);',
+        'games.insert',
         [
-            {**game.model_dump(), 'user_id': user_id}
+            {**game.model_dump(), 'user_id': user_id, 'encoded_game': compress_text(game.encoded_game, ENCODED_GAME_METRIC)}
             for game in games
         ],
     )
@@ -31,30 +131,54 @@ def save_games_(db: DBConnection, user_id: int, games: Game | Sequence[Game]) ->
 
 def update_game(db: DBConnection, game_id: int, game: Game) -> None:
     db.execute(
-        'UPDATE games '
-        'SET difficulty = :difficulty, encoded_game = :encoded_game, created_at = :created_at '
-        'WHERE id = :game_id;',
-        {**game.model_dump(), 'game_id': game_id},
+        'games.update',
+        {**game.model_dump(), 'game_id': game_id, 'encoded_game': compress_text(game.encoded_game, ENCODED_GAME_METRIC)},
     )
 
 
 def get_games_(db: DBConnection, user_id: int) -> list[Game]:
     rows = db.fetch_many(
-        'SELECT difficulty, encoded_game, created_at '
-        'FROM games '
-        'WHERE user_id = :user_id;',
+        'games.get_all',
         {'user_id': user_id}
     )
 
     return [
-        Game.model_validate(row)
+        Game.from_row(row)
         for row in rows
     ]
 
 
+def get_game_hash(encoded_game: str) -> str:
+    return hashlib.sha256(encoded_game.encode()).hexdigest()
+
+
+def apply_game_changes(encoded_game: str, changes: list[GameChange]) -> str:
+    '''
+    Changes are applied in order, each one to the result of the previous.
+    Every result is kept within `MAX_ENCODED_GAME_LENGTH`, so they cannot grow the game without limit.
+    '''
+    for change in changes:
+        if change.start > change.end or change.end > len(encoded_game):
+            raise invalid_change_exception
+
+        if len(encoded_game) - (change.end - change.start) + len(change.value) > settings.MAX_ENCODED_GAME_LENGTH:
+            raise game_too_long_exception
+
+        encoded_game = encoded_game[:change.start] + change.value + encoded_game[change.end:]
+
+    return encoded_game
+
+
+unknown_difficulty_exception = HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Unknown difficulty.')
+invalid_first_click_exception = HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid first click.')
+game_not_found_exception = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Game not found.')
+base_version_mismatch_exception = HTTPException(status_code=status.HTTP_409_CONFLICT, detail='The base version does not match.')
+invalid_change_exception = HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Change out of range.')
+game_too_long_exception = HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='The game is too long.')
 there_is_newer_version_exception = HTTPException(status_code=status.HTTP_409_CONFLICT, detail='There is a newer version.')
+patch_not_newer_exception = HTTPException(status_code=status.HTTP_409_CONFLICT, detail='The patch must be newer than its base version.')
 
-router = APIRouter(tags=['Games'])
+router = APIRouter(tags=['Games'], route_class=DatabaseRetryRoute)
 
 
 @router.put('', response_model=Game, responses={status.HTTP_409_CONFLICT: get_json_error_resonse('Already a Newer Version')})
@@ -64,9 +188,7 @@ def save_game(user_id: AuthenticatedUserID, game: Annotated[Game, Body()], respo
     Otherwise, it will result in an error (409).
     '''
     row = db.fetch_one(
-        'SELECT id, created_at '
-        'FROM games '
-        'WHERE user_id = :user_id AND difficulty = :difficulty;',
+        'games.get_version',
         {'user_id': user_id, 'difficulty': game.difficulty}
     )
 
@@ -86,15 +208,106 @@ def save_game(user_id: AuthenticatedUserID, game: Annotated[Game, Body()], respo
     return game
 
 
+@router.post('/new', response_model=NewGame, responses={
+    status.HTTP_422_UNPROCESSABLE_ENTITY: get_json_error_resonse('Unknown difficulty or invalid first click')
+})
+def new_game(
+    user_id: AuthenticatedUserID,
+    difficulty: Annotated[int, Query()],
+    seed: Annotated[int | None, Query(ge=0, lt=2 ** 63, description='Same seed and first click, same board.')] = None,
+    row: Annotated[int | None, Query(ge=0, description='First click. Defaults to the center of the board.')] = None,
+    column: Annotated[int | None, Query(ge=0)] = None,
+    no_guess: Annotated[bool, Query(description='Only boards that can be solved from the first click without guessing.')] = False
+) -> NewGame:
+    '''
+    Generates a board with the first click revealed, the first click and its neighbors never have mines.
+    Boards without `seed` and first click come from a pool generated ahead of time.
+    '''
+    dimensions = DIFFICULTIES.get(difficulty)
+
+    if dimensions is None:
+        raise unknown_difficulty_exception
+
+    first_click = None
+
+    if row is not None or column is not None:
+        if row is None or column is None or row >= dimensions.rows or column >= dimensions.columns:
+            raise invalid_first_click_exception
+
+        first_click = (row, column)
+
+    if seed is None and first_click is None:
+        pooled_game = (no_guess_board_pool if no_guess else board_pool).pop(difficulty)
+
+        if pooled_game is not None:
+            seed, encoded_game = pooled_game
+            return NewGame.model_construct(difficulty=difficulty, encoded_game=encoded_game, seed=seed)
+
+    if seed is None:
+        seed = secrets.randbits(63)
+
+    encoded_game = generate_game(difficulty, seed, first_click, no_guess)
+
+    return NewGame.model_construct(difficulty=difficulty, encoded_game=encoded_game, seed=seed)
+
+
+@router.patch('/{difficulty}', response_model=GameVersion, responses={
+    status.HTTP_404_NOT_FOUND: get_json_error_resonse('Game not found'),
+    status.HTTP_409_CONFLICT: get_json_error_resonse('Base version does not match')
+})
+def patch_game(user_id: AuthenticatedUserID, difficulty: Annotated[int, Path()], patch: Annotated[GamePatch, Body()], db: DBConnectionDep) -> GameVersion:
+    '''
+    Applies the changes to the saved game, only if it is still the base version (409 otherwise).
+    `created_at` must be greater than `base_created_at` (409 otherwise).
+    '''
+    row = db.fetch_one(
+        'games.get',
+        {'user_id': user_id, 'difficulty': difficulty}
+    )
+
+    if row is None:
+        raise game_not_found_exception
+
+    base_encoded_game = decompress_text(row.encoded_game)
+
+    if row.created_at != patch.base_created_at or (patch.base_hash is not None and patch.base_hash != get_game_hash(base_encoded_game)):
+        raise base_version_mismatch_exception
+
+    # Every version must have its own `created_at`, it is what the conditional update compares
+    if patch.created_at <= patch.base_created_at:
+        raise patch_not_newer_exception
+
+    game = Game.model_construct(
+        difficulty=difficulty,
+        encoded_game=apply_game_changes(base_encoded_game, patch.changes),
+        created_at=patch.created_at
+    )
+
+    # Only if no other request saved a version since it was read
+    updated_row = db.fetch_one(
+        'games.update_version',
+        {
+            'game_id': row.id,
+            'base_created_at': patch.base_created_at,
+            'encoded_game': compress_text(game.encoded_game, ENCODED_GAME_METRIC),
+            'created_at': game.created_at
+        }
+    )
+
+    if updated_row is None:
+        raise base_version_mismatch_exception
+
+    return GameVersion.model_construct(created_at=game.created_at, hash=get_game_hash(game.encoded_game))
+
+
 @router.delete('/{difficulty}', status_code=status.HTTP_204_NO_CONTENT)
 def delete_game(user_id: AuthenticatedUserID, difficulty: Annotated[int, Path()], db: DBConnectionDep) -> None:
     db.execute(
-        'DELETE FROM games '
-        'WHERE user_id = :user_id AND difficulty = :difficulty;',
+        'games.delete',
         {'user_id': user_id, 'difficulty': difficulty},
     )
 
 
 @router.get('', response_model=list[Game])
-def get_games(user_id: AuthenticatedUserID, db: DBConnectionDep) -> list[Game]:
+def get_games(user_id: AuthenticatedUserID, db: ReadDBConnectionDep) -> list[Game]:
     return get_games_(db, user_id)
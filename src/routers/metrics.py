@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import Annotated, Any
+from metrics import metrics
+from .auth import UnauthorizedException
+import settings
+import secrets
+
+
+get_metrics_token = HTTPBearer(scheme_name='Bearer Metrics Token')
+
+
+def authenticate_metrics(authorization_header: Annotated[HTTPAuthorizationCredentials, Depends(get_metrics_token)]) -> None:
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    if not secrets.compare_digest(authorization_header.credentials, settings.METRICS_TOKEN):
+        raise UnauthorizedException('Invalid metrics token.')
+
+
+router = APIRouter(tags=['Metrics'], dependencies=[Depends(authenticate_metrics)])
+
+
+@router.get('')
+def get_metrics() -> dict[str, Any]:
+    '''
+    In-process metrics of this worker, like query durations (`db.query.<statement>.duration_ms`).
+    Requires the `METRICS_TOKEN`.
+    '''
+    return metrics.snapshot()
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, HTTPException, status, Body, Path
-from database import DBConnectionDep, DBConnection
-from typing import Annotated
+from fastapi import APIRouter, HTTPException, status, Body, Path, Query, Response
+from fastapi.responses import StreamingResponse
+from database import DBConnectionDep, ReadDBConnectionDep, ReadDBConnectorDep, DBConnection, DatabaseRetryRoute, database_manager, statements
+from typing import Annotated, Callable, Iterator, Sequence
+from contextlib import AbstractContextManager
+from functools import partial
 from models import FromDBModel, CamelModel
 from .auth import AuthenticatedUserID
 from utils import get_json_error_resonse
+from ranking import rank_index
+from sketches import KLLSketch, time_distributions
+import numpy as np
+import settings
+import json
+import time
 
 
 class TimeRecord(FromDBModel, CamelModel):
@@ -13,6 +22,266 @@ class TimeRecord(FromDBModel, CamelModel):
     created_at: int
 
 
+class LeaderboardEntry(FromDBModel, CamelModel):
+    position: int
+    username: str
+    time: int
+    created_at: int
+
+
+class LeaderboardPosition(FromDBModel, CamelModel):
+    position: int
+    time: int
+    created_at: int
+
+
+class TimeStats(CamelModel):
+    difficulty: int
+    count: int
+    best: int
+    mean: float
+    median: float
+    p90: float
+    trend: float | None
+
+
+class HistogramBucket(CamelModel):
+    start: float
+    end: float
+    count: int
+
+
+class TimeDistribution(CamelModel):
+    count: int
+    p10: int
+    p50: int
+    p90: int
+    histogram: list[HistogramBucket]
+
+
+class TimeRank(CamelModel):
+    time: int
+    rank: int
+    players: int
+    percentile: float
+
+
+# (created_at, id) of the last record of the previous page
+Cursor = tuple[int, str]
+
+FIRST_PAGE_CURSOR: Cursor = (-2 ** 63, '')
+MAX_PAGE_SIZE = 1_000
+STREAM_BATCH_SIZE = 500
+HISTOGRAM_BUCKETS = 50
+
+
+statements.register(
+    'times.insert',
+    'INSERT INTO time_records (id, user_id, difficulty, time, created_at) '
+    'VALUES (:id, :user_id, :difficulty, :time, :created_at);'
+)
+statements.register(
+    'times.get_all',
+    'SELECT id, difficulty, time, created_at '
+    'FROM time_records '
+    'WHERE user_id = :user_id '
+    'ORDER BY created_at, id;'
+)
+statements.register(
+    'times.get_page',
+    'SELECT id, difficulty, time, created_at '
+    'FROM time_records '
+    'WHERE user_id = :user_id AND (created_at, id) > (:after_created_at, :after_id) '
+    'ORDER BY created_at, id '
+    'LIMIT :limit;'
+)
+statements.register(
+    'times.get_page_by_difficulty',
+    'SELECT id, difficulty, time, created_at '
+    'FROM time_records '
+    'WHERE user_id = :user_id AND difficulty = :difficulty AND (created_at, id) > (:after_created_at, :after_id) '
+    'ORDER BY created_at, id '
+    'LIMIT :limit;'
+)
+statements.register(
+    'times.get_ids',
+    'SELECT id '
+    'FROM time_records '
+    'WHERE user_id = :user_id;'
+)
+statements.register(
+    'times.get_id',
+    'SELECT id '
+    'FROM time_records '
+    'WHERE user_id = :user_id AND id = :record_id;'
+)
+statements.register(
+    'times.delete',
+    'DELETE FROM time_records '
+    'WHERE user_id = :user_id AND id = :record_id '
+    'RETURNING difficulty, time;'
+)
+statements.register(
+    'times.get_best_time',
+    'SELECT MIN(time) AS time '
+    'FROM time_records INDEXED BY time_records_user_id_difficulty_created_at '  # Otherwise SQLite walks the whole difficulty
+    'WHERE user_id = :user_id AND difficulty = :difficulty;'
+)
+statements.register(
+    'times.get_best_times',
+    'SELECT difficulty, user_id, MIN(time) AS time '
+    'FROM time_records '
+    'GROUP BY difficulty, user_id;'
+)
+statements.register(
+    'times.get_times_by_difficulty',
+    'SELECT time '
+    'FROM time_records '
+    'WHERE user_id = :user_id AND difficulty = :difficulty '
+    'ORDER BY created_at, id;'
+)
+statements.register(
+    'times.add_to_stats',
+    'INSERT INTO user_stats (user_id, difficulty, count, best, total) '
+    'VALUES (:user_id, :difficulty, 1, :time, :time) '
+    'ON CONFLICT (user_id, difficulty) DO UPDATE '
+    'SET count = count + 1, best = MIN(best, excluded.best), total = total + excluded.total, is_stale = 1;'
+)
+statements.register(
+    'times.remove_from_stats',
+    'UPDATE user_stats '
+    'SET count = count - 1, total = total - :time, is_stale = 1, best = COALESCE(('
+    '    SELECT MIN(time) '
+    '    FROM time_records INDEXED BY time_records_user_id_difficulty_created_at '  # Otherwise SQLite walks the whole difficulty
+    '    WHERE user_id = :user_id AND difficulty = :difficulty'
+    '), best) '
+    'WHERE user_id = :user_id AND difficulty = :difficulty;'
+)
+statements.register(
+    'times.delete_empty_stats',
+    'DELETE FROM user_stats '
+    'WHERE user_id = :user_id AND difficulty = :difficulty AND count = 0;'
+)
+statements.register(
+    'times.get_stats',
+    'SELECT difficulty, count, best, total, median, p90, trend, is_stale '
+    'FROM user_stats '
+    'WHERE user_id = :user_id '
+    'ORDER BY difficulty;'
+)
+statements.register(
+    'times.update_stats',
+    'UPDATE user_stats '
+    'SET median = :median, p90 = :p90, trend = :trend, is_stale = 0 '
+    'WHERE user_id = :user_id AND difficulty = :difficulty;'
+)
+statements.register(
+    'times.get_all_times',
+    'SELECT difficulty, time '
+    'FROM time_records;'
+)
+statements.register(
+    'times.get_distributions',
+    'SELECT difficulty, sketch '
+    'FROM time_distributions;'
+)
+statements.register(
+    'times.save_distribution',
+    'INSERT INTO time_distributions (difficulty, sketch, updated_at) '
+    'VALUES (:difficulty, :sketch, :updated_at) '
+    'ON CONFLICT (difficulty) DO UPDATE '
+    'SET sketch = excluded.sketch, updated_at = excluded.updated_at;'
+)
+statements.register(
+    'times.upsert_leaderboard_entry',
+    'INSERT INTO leaderboard (difficulty, user_id, record_id, time, created_at) '
+    'VALUES (:difficulty, :user_id, :id, :time, :created_at) '
+    'ON CONFLICT (difficulty, user_id) DO UPDATE '
+    'SET record_id = excluded.record_id, time = excluded.time, created_at = excluded.created_at '
+    'WHERE (excluded.time, excluded.created_at) < (leaderboard.time, leaderboard.created_at);'
+)
+statements.register(
+    'times.trim_leaderboard',
+    'DELETE FROM leaderboard '
+    'WHERE difficulty = :difficulty AND user_id IN ('
+    '    SELECT user_id '
+    '    FROM leaderboard '
+    '    WHERE difficulty = :difficulty '
+    '    ORDER BY time, created_at, user_id '
+    '    LIMIT -1 OFFSET :size'
+    ');'
+)
+statements.register(
+    'times.delete_leaderboard_entry',
+    'DELETE FROM leaderboard '
+    'WHERE difficulty = :difficulty AND user_id = :user_id AND record_id = :record_id '
+    'RETURNING user_id;'
+)
+statements.register(
+    'times.insert_next_leaderboard_entry',
+    'INSERT INTO leaderboard (difficulty, user_id, record_id, time, created_at) '
+    'SELECT difficulty, user_id, id, time, created_at '
+    'FROM time_records '
+    'WHERE difficulty = :difficulty AND user_id NOT IN ('
+    '    SELECT user_id '
+    '    FROM leaderboard '
+    '    WHERE difficulty = :difficulty'
+    ') '
+    'ORDER BY time, created_at '
+    'LIMIT 1;'
+)
+statements.register(
+    'times.clear_leaderboard',
+    'DELETE FROM leaderboard;'
+)
+statements.register(
+    'times.fill_leaderboard',
+    'INSERT INTO leaderboard (difficulty, user_id, record_id, time, created_at) '
+    'SELECT difficulty, user_id, id, time, created_at '
+    'FROM ('
+    '    SELECT *, ROW_NUMBER() OVER (PARTITION BY difficulty ORDER BY time, created_at, user_id) AS position '
+    '    FROM ('
+    '        SELECT *, ROW_NUMBER() OVER (PARTITION BY difficulty, user_id ORDER BY time, created_at) AS user_position '
+    '        FROM time_records'
+    '    ) '
+    '    WHERE user_position = 1'
+    ') '
+    'WHERE position <= :size;'
+)
+statements.register(
+    'times.get_leaderboard_size',
+    'SELECT size '
+    'FROM leaderboard_size '
+    'WHERE id = 0 AND EXISTS (SELECT 1 FROM leaderboard);'
+)
+statements.register(
+    'times.save_leaderboard_size',
+    'INSERT INTO leaderboard_size (id, size) '
+    'VALUES (0, :size) '
+    'ON CONFLICT (id) DO UPDATE '
+    'SET size = excluded.size;'
+)
+statements.register(
+    'times.get_leaderboard',
+    'SELECT users.username, leaderboard.time, leaderboard.created_at '
+    'FROM leaderboard '
+    'JOIN users ON users.id = leaderboard.user_id '
+    'WHERE leaderboard.difficulty = :difficulty '
+    'ORDER BY leaderboard.time, leaderboard.created_at, leaderboard.user_id '
+    'LIMIT :limit;'
+)
+statements.register(
+    'times.get_leaderboard_position',
+    'SELECT COUNT(better_entry.user_id) + 1 AS position, entry.time, entry.created_at '
+    'FROM leaderboard AS entry '
+    'LEFT JOIN leaderboard AS better_entry '
+    '    ON better_entry.difficulty = entry.difficulty '
+    '    AND (better_entry.time, better_entry.created_at, better_entry.user_id) < (entry.time, entry.created_at, entry.user_id) '
+    'WHERE entry.difficulty = :difficulty AND entry.user_id = :user_id '
+    'GROUP BY entry.user_id;'
+)
+
+
 def save_time_records_(db: DBConnection, user_id: int, time_records: TimeRecord | list[TimeRecord]) -> None:
     if not isinstance(time_records, list):
         time_records = [time_records]
@@ -21,32 +290,322 @@ def save_time_records_(db: DBConnection, user_id: int, time_records: TimeRecord
         return
 
     db.execute(
-        'INSERT INTO time_records (id, user_id, difficulty, time, created_at) '
-        'VALUES (:id, :user_id, :difficulty, :time, :created_at);',
+        'times.insert',
+        [
+            {**record.model_dump(), 'user_id': user_id}
+            for record in time_records
+        ],
+    )
+
+    update_leaderboard(db, user_id, time_records)
+
+    db.execute(
+        'times.add_to_stats',
+        [
+            {'user_id': user_id, 'difficulty': record.difficulty, 'time': record.time}
+            for record in time_records
+        ],
+    )
+
+    for record in time_records:
+        db.on_commit(partial(rank_index.add_time, record.difficulty, user_id, record.time))
+        db.on_commit(partial(time_distributions.add, record.difficulty, record.time))
+
+
+def update_leaderboard(db: DBConnection, user_id: int, time_records: list[TimeRecord]) -> None:
+    '''
+    Keeps the best record of the user and trims the leaderboards of the affected difficulties
+    to `LEADERBOARD_SIZE` entries.
+    '''
+    db.execute(
+        'times.upsert_leaderboard_entry',
         [
             {**record.model_dump(), 'user_id': user_id}
             for record in time_records
         ],
     )
 
+    db.execute(
+        'times.trim_leaderboard',
+        [
+            {'difficulty': difficulty, 'size': settings.LEADERBOARD_SIZE}
+            for difficulty in {record.difficulty for record in time_records}
+        ],
+    )
+
+
+def remove_from_leaderboard(db: DBConnection, user_id: int, record_id: str, difficulty: int) -> None:
+    '''
+    If the record was in the leaderboard, its place is taken by the best record outside of it.
+    Finding it walks the records of the difficulty by time, past the ones of every user in the leaderboard.
+    '''
+    row = db.fetch_one(
+        'times.delete_leaderboard_entry',
+        {'difficulty': difficulty, 'user_id': user_id, 'record_id': record_id},
+    )
+
+    if row is None:
+        return
+
+    db.execute(
+        'times.insert_next_leaderboard_entry',
+        {'difficulty': difficulty},
+    )
+
+
+def remove_from_stats(db: DBConnection, user_id: int, difficulty: int, time: int) -> None:
+    parameters = {'user_id': user_id, 'difficulty': difficulty, 'time': time}
+
+    db.execute('times.remove_from_stats', parameters)
+    db.execute('times.delete_empty_stats', parameters)
+
+
+def compute_time_stats(times: Sequence[int], trend_window: int) -> tuple[float, float, float | None]:
+    '''
+    Returns the median, the 90th percentile and the trend of times sorted by creation.
+    The trend is how much faster (%) the mean of the last `trend_window` times is than the mean of the ones before them,
+    `None` if there are not enough times.
+    '''
+    values = np.asarray(times, dtype=np.float64)
+    median, p90 = np.percentile(values, (50, 90))
+
+    recent = values[-trend_window:]
+    previous = values[-2 * trend_window:-trend_window]
+    trend = None
+
+    if trend_window > 0 and previous.size:
+        previous_mean = previous.mean()
+        trend = float((previous_mean - recent.mean()) / previous_mean * 100) if previous_mean else 0.0
+
+    return float(median), float(p90), trend
+
+
+def get_time_stats_(db: DBConnection, user_id: int) -> list[TimeStats]:
+    '''
+    Stats invalidated by a write are recomputed from the user's times and saved again.
+    '''
+    rows = db.fetch_many(
+        'times.get_stats',
+        {'user_id': user_id}
+    )
+
+    time_stats: list[TimeStats] = []
+
+    for row in rows:
+        median, p90, trend = row.median, row.p90, row.trend
+
+        if row.is_stale:
+            times = db.fetch_many(
+                'times.get_times_by_difficulty',
+                {'user_id': user_id, 'difficulty': row.difficulty}
+            )
+
+            median, p90, trend = compute_time_stats([time_row.time for time_row in times], settings.STATS_TREND_WINDOW)
+
+            db.execute(
+                'times.update_stats',
+                {'user_id': user_id, 'difficulty': row.difficulty, 'median': median, 'p90': p90, 'trend': trend}
+            )
+
+        time_stats.append(TimeStats.model_construct(
+            difficulty=row.difficulty,
+            count=row.count,
+            best=row.best,
+            mean=row.total / row.count,
+            median=median,
+            p90=p90,
+            trend=trend
+        ))
+
+    return time_stats
+
+
+def update_rank_index(db: DBConnection, user_id: int, difficulty: int) -> None:
+    row = db.fetch_one(
+        'times.get_best_time',
+        {'user_id': user_id, 'difficulty': difficulty}
+    )
+
+    db.on_commit(partial(rank_index.set_best_time, difficulty, user_id, row.time if row else None))
+
+
+def rebuild_leaderboard() -> None:
+    '''
+    Fills the leaderboards again from the records when `LEADERBOARD_SIZE` changed since the last time
+    or they are empty (eg: first start), otherwise they are kept up to date by every write.
+    Temporary databases start empty, so there is nothing to load.
+    '''
+    if database_manager.is_tmp_db:
+        return
+
+    with database_manager.connect() as db:
+        refill_leaderboard(db, settings.LEADERBOARD_SIZE)
+
+
+def refill_leaderboard(db: DBConnection, size: int) -> None:
+    # No row when the leaderboards are empty
+    row = db.fetch_one('times.get_leaderboard_size')
+
+    if row is not None and row.size == size:
+        return
+
+    db.execute('times.clear_leaderboard')
+    db.execute('times.fill_leaderboard', {'size': size})
+    db.execute('times.save_leaderboard_size', {'size': size})
+
+
+def rebuild_rank_index() -> None:
+    '''
+    Temporary databases start empty, so there is nothing to load.
+    '''
+    if database_manager.is_tmp_db:
+        return
+
+    with database_manager.connect_read() as db:
+        rows = db.fetch_many('times.get_best_times')
+
+    rank_index.rebuild((row.difficulty, row.user_id, row.time) for row in rows)
+
+
+def load_time_distributions() -> None:
+    '''
+    Loads the last checkpoint, the records are only read when there is none (first start).
+    '''
+    if database_manager.is_tmp_db:
+        return
+
+    with database_manager.connect_read() as db:
+        rows = db.fetch_many('times.get_distributions')
+
+        if rows:
+            time_distributions.load({row.difficulty: KLLSketch.from_dict(json.loads(row.sketch)) for row in rows})
+            return
+
+        sketches: dict[int, KLLSketch] = {}
+
+        for row in db.fetch_many('times.get_all_times'):
+            sketches.setdefault(row.difficulty, KLLSketch()).update(row.time)
+
+    time_distributions.load(sketches)
+    time_distributions.mark_dirty(sketches.keys())
+    checkpoint_time_distributions()
+
+
+def checkpoint_time_distributions() -> None:
+    if database_manager.is_tmp_db:
+        return
+
+    sketches = time_distributions.pop_dirty()
+
+    if not sketches:
+        return
+
+    try:
+        with database_manager.connect() as db:
+            db.execute(
+                'times.save_distribution',
+                [
+                    {'difficulty': difficulty, 'sketch': json.dumps(sketch), 'updated_at': int(time.time() * 1_000)}
+                    for difficulty, sketch in sketches.items()
+                ]
+            )
+
+    except Exception:
+        time_distributions.mark_dirty(sketches.keys())
+        raise
+
 
 def get_time_records_(db: DBConnection, user_id: int) -> list[TimeRecord]:
     rows = db.fetch_many(
-        'SELECT id, difficulty, time, created_at '
-        'FROM time_records '
-        'WHERE user_id = :user_id;',
+        'times.get_all',
         {'user_id': user_id}
     )
 
     return [
-        TimeRecord.model_validate(row)
+        TimeRecord.from_row(row)
+        for row in rows
+    ]
+
+
+def get_time_records_page(
+    db: DBConnection,
+    user_id: int,
+    limit: int | None = None,
+    after: Cursor = FIRST_PAGE_CURSOR,
+    difficulty: int | None = None
+) -> list[TimeRecord]:
+    parameters = {
+        'user_id': user_id,
+        'difficulty': difficulty,
+        'after_created_at': after[0],
+        'after_id': after[1],
+        'limit': -1 if limit is None else limit
+    }
+
+    rows = db.fetch_many(
+        'times.get_page' if difficulty is None else 'times.get_page_by_difficulty',
+        parameters
+    )
+
+    return [
+        TimeRecord.from_row(row)
         for row in rows
     ]
 
 
+def encode_cursor(time_record: TimeRecord) -> str:
+    return f'{time_record.created_at}:{time_record.id}'
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    created_at, separator, record_id = cursor.partition(':')
+
+    try:
+        if not separator:
+            raise ValueError()
+
+        return int(created_at), record_id
+
+    except ValueError:
+        raise invalid_cursor_exception
+
+
+def stream_time_records(
+    connect_read: Callable[[], AbstractContextManager[DBConnection]],
+    user_id: int,
+    limit: int | None,
+    after: Cursor,
+    difficulty: int | None
+) -> Iterator[str]:
+    '''
+    Yields NDJSON lines, reading one batch at a time with a short lived connection.
+    '''
+    remaining = limit
+
+    while remaining is None or remaining > 0:
+        batch_size = STREAM_BATCH_SIZE if remaining is None else min(remaining, STREAM_BATCH_SIZE)
+
+        with connect_read() as db:
+            time_records = get_time_records_page(db, user_id, batch_size, after, difficulty)
+
+        for time_record in time_records:
+            yield time_record.model_dump_json(by_alias=True) + '\n'
+
+        if len(time_records) < batch_size:
+            return
+
+        after = (time_records[-1].created_at, time_records[-1].id)
+
+        if remaining is not None:
+            remaining -= len(time_records)
+
+
+no_time_exception = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='No time in this difficulty.')
+not_in_leaderboard_exception = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Not in the leaderboard.')
+invalid_cursor_exception = HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Invalid cursor.')
 id_already_exists_exception = HTTPException(status_code=status.HTTP_409_CONFLICT, detail='A TimeRecord with that ID already exists.')
 
-router = APIRouter(tags=['Time Records'])
+router = APIRouter(tags=['Time Records'], route_class=DatabaseRetryRoute)
 
 
 @router.post('', response_model=TimeRecord, status_code=status.HTTP_201_CREATED, responses={
@@ -57,9 +616,7 @@ def save_time_record(user_id: AuthenticatedUserID, time_record: Annotated[TimeRe
     Providing a record with an existing 'id' will result in an error (409).
     '''
     row = db.fetch_one(
-        'SELECT id '
-        'FROM time_records '
-        'WHERE user_id = :user_id AND id = :record_id',
+        'times.get_id',
         {'user_id': user_id, 'record_id': time_record.id}
     )
 
@@ -72,13 +629,151 @@ def save_time_record(user_id: AuthenticatedUserID, time_record: Annotated[TimeRe
 
 @router.delete('/{record_id}', status_code=status.HTTP_204_NO_CONTENT)
 def delete_time_record(user_id: AuthenticatedUserID, record_id: Annotated[str, Path()], db: DBConnectionDep) -> None:
-    db.execute(
-        'DELETE FROM time_records '
-        'WHERE user_id = :user_id AND id = :record_id;',
+    row = db.fetch_one(
+        'times.delete',
         {'user_id': user_id, 'record_id': record_id},
     )
 
+    if row is not None:
+        remove_from_leaderboard(db, user_id, record_id, row.difficulty)
+        remove_from_stats(db, user_id, row.difficulty, row.time)
+        update_rank_index(db, user_id, row.difficulty)
+
+
+@router.get('/leaderboard/{difficulty}', response_model=list[LeaderboardEntry])
+def get_leaderboard(
+    user_id: AuthenticatedUserID,
+    difficulty: Annotated[int, Path()],
+    db: ReadDBConnectionDep,
+    limit: Annotated[int | None, Query(ge=1, description='Defaults to the whole leaderboard.')] = None
+) -> list[LeaderboardEntry]:
+    '''
+    Best time of each user, sorted from fastest to slowest.
+    Only the best `LEADERBOARD_SIZE` users are kept.
+    '''
+    rows = db.fetch_many(
+        'times.get_leaderboard',
+        {'difficulty': difficulty, 'limit': settings.LEADERBOARD_SIZE if limit is None else min(limit, settings.LEADERBOARD_SIZE)}
+    )
+
+    return [
+        LeaderboardEntry.model_construct(position=position, username=row.username, time=row.time, created_at=row.created_at)
+        for position, row in enumerate(rows, start=1)
+    ]
+
+
+@router.get('/leaderboard/{difficulty}/rank', response_model=LeaderboardPosition, responses={
+    status.HTTP_404_NOT_FOUND: get_json_error_resonse('Not in the leaderboard')
+})
+def get_leaderboard_position(user_id: AuthenticatedUserID, difficulty: Annotated[int, Path()], db: ReadDBConnectionDep) -> LeaderboardPosition:
+    '''
+    Position of the user's best time in the leaderboard.
+    '''
+    row = db.fetch_one(
+        'times.get_leaderboard_position',
+        {'difficulty': difficulty, 'user_id': user_id}
+    )
+
+    if row is None:
+        raise not_in_leaderboard_exception
+
+    return LeaderboardPosition.from_row(row)
+
+
+@router.get('/stats', response_model=list[TimeStats])
+def get_time_stats(user_id: AuthenticatedUserID, db: DBConnectionDep) -> list[TimeStats]:
+    '''
+    Stats of the user's records per difficulty.
+    'trend' is how much faster (%) the last `STATS_TREND_WINDOW` records are than the ones before them.
+    '''
+    return get_time_stats_(db, user_id)
+
+
+@router.get('/distribution/{difficulty}', response_model=TimeDistribution, responses={
+    status.HTTP_404_NOT_FOUND: get_json_error_resonse('No time in this difficulty')
+})
+def get_time_distribution(
+    user_id: AuthenticatedUserID,
+    difficulty: Annotated[int, Path()],
+    buckets: Annotated[int, Query(ge=1, le=500)] = HISTOGRAM_BUCKETS
+) -> TimeDistribution:
+    '''
+    Approximate distribution of every time saved in the difficulty (deleted records included).
+    '''
+    count, (p10, p50, p90), histogram = time_distributions.get_summary(difficulty, (0.1, 0.5, 0.9), buckets)
+
+    if not count:
+        raise no_time_exception
+
+    return TimeDistribution.model_construct(
+        count=count,
+        p10=p10,
+        p50=p50,
+        p90=p90,
+        histogram=[
+            HistogramBucket.model_construct(start=start, end=end, count=bucket_count)
+            for start, end, bucket_count in histogram
+        ]
+    )
+
+
+@router.get('/rank/{difficulty}', response_model=TimeRank, responses={
+    status.HTTP_404_NOT_FOUND: get_json_error_resonse('No time in this difficulty')
+})
+def get_time_rank(
+    user_id: AuthenticatedUserID,
+    difficulty: Annotated[int, Path()],
+    time: Annotated[int | None, Query(description="Defaults to the user's best time.")] = None
+) -> TimeRank:
+    '''
+    Rank the time would have among the best time of every user,
+    'percentile' is the percentage of users with a slower best time.
+    '''
+    if time is None:
+        time = rank_index.get_best_time(difficulty, user_id)
+
+        if time is None:
+            raise no_time_exception
+
+    rank, players, slower_players = rank_index.get_rank(difficulty, time)
+
+    return TimeRank.model_construct(
+        time=time,
+        rank=rank,
+        players=players,
+        percentile=slower_players / players * 100 if players else 0.0
+    )
+
+
+@router.get('', response_model=list[TimeRecord], responses={
+    status.HTTP_200_OK: {'content': {'application/x-ndjson': {}}}
+})
+def get_time_records(
+    user_id: AuthenticatedUserID,
+    response: Response,
+    connect_read: ReadDBConnectorDep,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE, description='Max number of records. All of them if not set.')] = None,
+    after: Annotated[str | None, Query(description='Cursor from the `X-Next-Cursor` header of the previous page.')] = None,
+    difficulty: Annotated[int | None, Query()] = None,
+    stream: Annotated[bool, Query(description='Stream the records as NDJSON (application/x-ndjson).')] = False
+) -> list[TimeRecord] | StreamingResponse:
+    '''
+    Records are sorted by creation time.
+    When the page is full, the `X-Next-Cursor` header contains the cursor to request the next one.
+    '''
+    # No connection dependency, streams open their own while the response is sent
+    after_cursor = FIRST_PAGE_CURSOR if after is None else decode_cursor(after)
+
+    if stream:
+        return StreamingResponse(
+            stream_time_records(connect_read, user_id, limit, after_cursor, difficulty),
+            media_type='application/x-ndjson'
+        )
+
+    with connect_read() as db:
+        time_records = get_time_records_page(db, user_id, limit, after_cursor, difficulty)
+
+    if limit is not None and len(time_records) == limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(time_records[-1])
 
-@router.get('', response_model=list[TimeRecord])
-def get_time_records(user_id: AuthenticatedUserID, db: DBConnectionDep) -> list[TimeRecord]:
-    return get_time_records_(db, user_id)
+    return time_records
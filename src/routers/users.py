@@ -1,12 +1,13 @@
 from fastapi import APIRouter, HTTPException, status, Body, Response
-from database import DBConnectionDep, DBConnection
+from database import DBConnectionDep, ReadDBConnectionDep, DBConnection, DatabaseRetryRoute, statements
 from typing import Annotated
 from models import User, CamelModel
-from .games import Game, save_games_, update_game, get_games_
-from .times import TimeRecord, save_time_records_, get_time_records_
-from .game_settings import GameSettings, update_game_settings, save_game_settings, get_game_settings_
+from .games import Game, save_games_, update_game
+from .times import TimeRecord, save_time_records_
+from .game_settings import GameSettings, update_game_settings, save_game_settings
 from .auth import AuthenticatedUserID
 from utils import get_json_error_resonse
+from compression import decompress_text
 
 
 class SyncData(CamelModel):
@@ -21,27 +22,87 @@ class OptionalSyncData(CamelModel):
     settings: GameSettings | None
 
 
+statements.register(
+    'users.get',
+    'SELECT username '
+    'FROM users '
+    'WHERE id = :user_id;'
+)
+statements.register(
+    'users.get_sync_snapshot',
+    "SELECT 'game' AS kind, difficulty AS c1, encoded_game AS c2, created_at AS c3, "
+    '    NULL AS c4, NULL AS c5, NULL AS c6, NULL AS c7, NULL AS c8, NULL AS c9 '
+    'FROM games '
+    'WHERE user_id = :user_id '
+    'UNION ALL '
+    "SELECT 'time_record', id, difficulty, time, created_at, "
+    '    NULL, NULL, NULL, NULL, NULL '
+    'FROM time_records '
+    'WHERE user_id = :user_id '
+    'UNION ALL '
+    "SELECT 'settings', theme, initial_zoom, action_toggle, default_action, "
+    '    long_tap_delay, easy_digging, vibration, vibration_intensity, modified_at '
+    'FROM game_settings '
+    'WHERE user_id = :user_id '
+    'ORDER BY kind, c4, c1;'  # Time records by (created_at, id)
+)
+
+
 def get_user_(db: DBConnection, user_id: int) -> User | None:
     row = db.fetch_one(
-        'SELECT username '
-        'FROM users '
-        'WHERE id = :user_id;',
+        'users.get',
         {'user_id': user_id}
     )
 
     if row is None:
         return None
 
-    return User.model_validate(row)
+    return User.from_row(row)
+
+
+def get_sync_data_(db: DBConnection, user_id: int) -> OptionalSyncData:
+    '''
+    Loads games, time records and settings with a single query.
+    Each row has a `kind` discriminator and its values in positional columns (c1...c9).
+    The order is set on the whole compound query, since SQLite does not keep the order of its parts.
+    Rows come from our own schema, so models are built without validation.
+    '''
+    rows = db.fetch_many('users.get_sync_snapshot', {'user_id': user_id})
+
+    games: list[Game] = []
+    time_records: list[TimeRecord] = []
+    game_settings: GameSettings | None = None
+
+    for row in rows:
+        if row.kind == 'game':
+            games.append(Game.model_construct(difficulty=row.c1, encoded_game=decompress_text(row.c2), created_at=row.c3))
+
+        elif row.kind == 'time_record':
+            time_records.append(TimeRecord.model_construct(id=row.c1, difficulty=row.c2, time=row.c3, created_at=row.c4))
+
+        else:
+            game_settings = GameSettings.model_construct(
+                theme=row.c1,
+                initial_zoom=bool(row.c2),
+                action_toggle=bool(row.c3),
+                default_action=row.c4,
+                long_tap_delay=row.c5,
+                easy_digging=bool(row.c6),
+                vibration=bool(row.c7),
+                vibration_intensity=row.c8,
+                modified_at=row.c9
+            )
+
+    return OptionalSyncData.model_construct(games=games, time_records=time_records, settings=game_settings)
 
 
 not_found_exception = HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-router = APIRouter(tags=['Users'])
+router = APIRouter(tags=['Users'], route_class=DatabaseRetryRoute)
 
 
 @router.get('/me', response_model=User)
-def get_user(user_id: AuthenticatedUserID, db: DBConnectionDep) -> User:
+def get_user(user_id: AuthenticatedUserID, db: ReadDBConnectionDep) -> User:
     '''
     Retrieve user data.
     '''
@@ -67,9 +128,7 @@ def sync_data(user_id: AuthenticatedUserID, sync_data: Annotated[SyncData, Body(
 
     if sync_data.time_records:
         rows = db.fetch_many(
-            'SELECT id '
-            'FROM time_records '
-            'WHERE user_id = :user_id;',
+            'times.get_ids',
             {'user_id': user_id}
         )
 
@@ -93,9 +152,7 @@ def sync_data(user_id: AuthenticatedUserID, sync_data: Annotated[SyncData, Body(
                 has_created = True
 
     row = db.fetch_one(
-        'SELECT id, modified_at '
-        'FROM game_settings '
-        'WHERE user_id = :user_id;',
+        'settings.get_version',
         {'user_id': user_id}
     )
 
@@ -108,9 +165,7 @@ def sync_data(user_id: AuthenticatedUserID, sync_data: Annotated[SyncData, Body(
 
     if sync_data.games:
         rows = db.fetch_many(
-            'SELECT id, difficulty, created_at '
-            'FROM games '
-            'WHERE user_id = :user_id;',
+            'games.get_versions',
             {'user_id': user_id}
         )
 
@@ -151,34 +206,24 @@ def sync_data(user_id: AuthenticatedUserID, sync_data: Annotated[SyncData, Body(
             for game_id, game in games_to_update:
                 update_game(db, game_id, game)
 
-    updated_time_records = get_time_records_(db, user_id)
-    updated_settings = get_game_settings_(db, user_id)
-    updated_games = get_games_(db, user_id)
+    updated_sync_data = get_sync_data_(db, user_id)
 
     if any((
-        not updated_time_records and sync_data.time_records,
-        updated_settings is None,
-        not updated_games and sync_data.games
+        not updated_sync_data.time_records and sync_data.time_records,
+        updated_sync_data.settings is None,
+        not updated_sync_data.games and sync_data.games
     )):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Data could not be saved.')
 
     if has_created:
         response.status_code = status.HTTP_201_CREATED
 
-    return OptionalSyncData(
-        time_records=updated_time_records,
-        settings=updated_settings,
-        games=updated_games
-    )
+    return updated_sync_data
 
 
 @router.get('/sync', response_model=OptionalSyncData)
-def get_sync_data(user_id: AuthenticatedUserID, db: DBConnectionDep) -> OptionalSyncData:
+def get_sync_data(user_id: AuthenticatedUserID, db: ReadDBConnectionDep) -> OptionalSyncData:
     '''
     Retrieve the latest data.
     '''
-    return OptionalSyncData(
-        time_records=get_time_records_(db, user_id),
-        settings=get_game_settings_(db, user_id),
-        games=get_games_(db, user_id)
-    )
+    return get_sync_data_(db, user_id)
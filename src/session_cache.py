@@ -0,0 +1,75 @@
+from typing import NamedTuple
+from collections import OrderedDict
+from threading import Lock
+from metrics import metrics
+import settings
+import time
+
+
+class SessionState(NamedTuple):
+    token_id: int
+    family_id: int
+    is_invalidated: bool
+
+
+# (user_id, device_id)
+SessionKey = tuple[int, int]
+
+
+class SessionCache:
+    '''
+    LRU cache of the `auth` rows, entries live at most `ttl_seconds`.
+    Family ids and token ids only grow and invalidated families are never valid again,
+    so an outdated entry can still reject a refresh token but never accept one (that is left to the database).
+
+    Metrics: `auth.session_cache.{hits,misses,evictions}`.
+    '''
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # key -> (state, expires_at)
+        self.entries: OrderedDict[SessionKey, tuple[SessionState, float]] = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key: SessionKey) -> SessionState | None:
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[1] <= time.monotonic():
+                del self.entries[key]
+                entry = None
+                metrics.increment('auth.session_cache.evictions')
+
+            if entry is None:
+                metrics.increment('auth.session_cache.misses')
+                return None
+
+            self.entries.move_to_end(key)
+
+        metrics.increment('auth.session_cache.hits')
+
+        return entry[0]
+
+    def put(self, key: SessionKey, state: SessionState) -> None:
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (state, time.monotonic() + self.ttl_seconds)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                metrics.increment('auth.session_cache.evictions')
+
+    def pop(self, key: SessionKey) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+session_cache = SessionCache(settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL_SECONDS)
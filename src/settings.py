@@ -36,3 +36,47 @@ REFRESH_TOKEN_EXPIRE_DAYS = getvar(int, 'REFRESH_TOKEN_EXPIRE_DAYS', default=30)
 
 DATABASE_URL = getvar(str, 'DATABASE_URL', default='sqlite+pysqlite:///:memory:')
 DATABASE_CHECK_TABLE = getvar(str, 'DATABASE_CHECK_TABLE', default='')
+
+# SQLite performance profile, applied to every new connection
+DATABASE_JOURNAL_MODE = getvar(str, 'DATABASE_JOURNAL_MODE', default='WAL')
+DATABASE_SYNCHRONOUS = getvar(str, 'DATABASE_SYNCHRONOUS', default='NORMAL')
+DATABASE_MMAP_SIZE = getvar(int, 'DATABASE_MMAP_SIZE', default=268_435_456)
+DATABASE_CACHE_SIZE = getvar(int, 'DATABASE_CACHE_SIZE', default=-64_000)
+DATABASE_TEMP_STORE = getvar(str, 'DATABASE_TEMP_STORE', default='MEMORY')
+DATABASE_BUSY_TIMEOUT = getvar(int, 'DATABASE_BUSY_TIMEOUT', default=5_000)
+
+DATABASE_SLOW_QUERY_MS = getvar(int, 'DATABASE_SLOW_QUERY_MS', default=100)
+
+# Retries of requests that failed because the database was locked
+DATABASE_RETRY_ATTEMPTS = getvar(int, 'DATABASE_RETRY_ATTEMPTS', default=5)
+DATABASE_RETRY_BASE_DELAY_MS = getvar(int, 'DATABASE_RETRY_BASE_DELAY_MS', default=10)
+DATABASE_RETRY_MAX_DELAY_MS = getvar(int, 'DATABASE_RETRY_MAX_DELAY_MS', default=500)
+
+METRICS_TOKEN = getvar(str, 'METRICS_TOKEN', default='')
+
+LEADERBOARD_SIZE = getvar(int, 'LEADERBOARD_SIZE', default=100)
+STATS_TREND_WINDOW = getvar(int, 'STATS_TREND_WINDOW', default=10)
+DISTRIBUTION_CHECKPOINT_MINUTES = getvar(int, 'DISTRIBUTION_CHECKPOINT_MINUTES', default=5)
+
+MAX_ENCODED_GAME_LENGTH = getvar(int, 'MAX_ENCODED_GAME_LENGTH', default=10_000)
+
+BOARD_POOL_SIZE = getvar(int, 'BOARD_POOL_SIZE', default=20)
+BOARD_POOL_REFILL_PER_SECOND = getvar(int, 'BOARD_POOL_REFILL_PER_SECOND', default=20)
+
+TOKEN_CACHE_SIZE = getvar(int, 'TOKEN_CACHE_SIZE', default=10_000)
+SESSION_CACHE_SIZE = getvar(int, 'SESSION_CACHE_SIZE', default=10_000)
+SESSION_CACHE_TTL_SECONDS = getvar(int, 'SESSION_CACHE_TTL_SECONDS', default=300)
+
+# Password hashing (bcrypt) process pool
+PASSWORD_WORKERS = getvar(int, 'PASSWORD_WORKERS', default=os.cpu_count() or 1)
+PASSWORD_QUEUE_SIZE = getvar(int, 'PASSWORD_QUEUE_SIZE', default=32)
+PASSWORD_RETRY_AFTER_SECONDS = getvar(int, 'PASSWORD_RETRY_AFTER_SECONDS', default=1)
+
+# Token buckets of the credential endpoints, by client IP and by username
+RATE_LIMIT_IP_BURST = getvar(int, 'RATE_LIMIT_IP_BURST', default=20)
+RATE_LIMIT_IP_PER_MINUTE = getvar(int, 'RATE_LIMIT_IP_PER_MINUTE', default=30)
+RATE_LIMIT_USERNAME_BURST = getvar(int, 'RATE_LIMIT_USERNAME_BURST', default=10)
+RATE_LIMIT_USERNAME_PER_MINUTE = getvar(int, 'RATE_LIMIT_USERNAME_PER_MINUTE', default=10)
+RATE_LIMIT_MAX_KEYS = getvar(int, 'RATE_LIMIT_MAX_KEYS', default=100_000)
+
+THREADPOOL_SIZE = getvar(int, 'THREADPOOL_SIZE', default=40)
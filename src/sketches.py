@@ -0,0 +1,229 @@
+from typing import Any, Iterable, Sequence
+from threading import Lock
+import math
+import random
+
+
+class KLLSketch:
+    '''
+    KLL quantile sketch (Karnin, Lang, Liberty), keeps O(k) of the values seen
+    with a rank error of roughly 1.65 / k, and sketches can be merged.
+
+    Level `h` holds values with a weight of 2^h. When the sketch is full,
+    the lowest full level is sorted and every other value is promoted to the next one.
+    '''
+
+    def __init__(self, k: int = 200, c: float = 2 / 3):
+        self.k = k
+        self.c = c
+        self.compactors: list[list[int]] = []
+        self.count = 0
+        self.min: int | None = None
+        self.max: int | None = None
+        self.size = 0
+        self.max_size = 0
+        self._grow()
+
+    def _grow(self) -> None:
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return math.ceil(self.c ** depth * self.k) + 1
+
+    def _compress(self) -> None:
+        for level, compactor in enumerate(self.compactors):
+            if len(compactor) < self._capacity(level):
+                continue
+
+            if level + 1 >= len(self.compactors):
+                self._grow()
+
+            compactor.sort()
+            # An odd value out stays in this level
+            remainder = [compactor.pop()] if len(compactor) % 2 else []
+
+            self.compactors[level + 1].extend(compactor[random.randint(0, 1)::2])
+            self.compactors[level] = remainder
+
+            self.size = sum(len(compactor) for compactor in self.compactors)
+            return
+
+    def update(self, value: int) -> None:
+        self.compactors[0].append(value)
+        self.count += 1
+        self.size += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+        if self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other: 'KLLSketch') -> None:
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+
+        self.count += other.count
+        self.size = sum(len(compactor) for compactor in self.compactors)
+
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+        while self.size >= self.max_size:
+            self._compress()
+
+    def _weighted_values(self) -> list[tuple[int, int]]:
+        return sorted(
+            (value, 2 ** level)
+            for level, compactor in enumerate(self.compactors)
+            for value in compactor
+        )
+
+    def quantiles(self, fractions: Sequence[float]) -> list[int | None]:
+        '''
+        Estimated value at each fraction (0 to 1) of the sorted values.
+        '''
+        weighted_values = self._weighted_values()
+        total_weight = sum(weight for _, weight in weighted_values)
+        results: list[int | None] = []
+
+        for fraction in fractions:
+            if not weighted_values:
+                results.append(None)
+                continue
+
+            target = fraction * total_weight
+            cumulative_weight = 0
+
+            for value, weight in weighted_values:
+                cumulative_weight += weight
+
+                if cumulative_weight >= target:
+                    break
+
+            results.append(value)
+
+        return results
+
+    def histogram(self, buckets: int) -> list[tuple[float, float, int]]:
+        '''
+        Estimated counts of `buckets` equal width buckets between the min and max values,
+        as (start, end, count) tuples. The last bucket includes its end.
+        '''
+        if self.min is None or self.max is None:
+            return []
+
+        width = (self.max - self.min) / buckets or 1
+        counts = [0.0] * buckets
+        weighted_values = self._weighted_values()
+        total_weight = sum(weight for _, weight in weighted_values)
+
+        for value, weight in weighted_values:
+            counts[min(int((value - self.min) / width), buckets - 1)] += weight
+
+        # Weights are scaled back to the real count, they only add up to it approximately
+        scale = self.count / total_weight if total_weight else 0
+
+        return [
+            (self.min + index * width, self.min + (index + 1) * width, round(count * scale))
+            for index, count in enumerate(counts)
+        ]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'k': self.k,
+            'c': self.c,
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'compactors': [list(compactor) for compactor in self.compactors]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> 'KLLSketch':
+        sketch = cls(data['k'], data['c'])
+
+        for _ in range(len(data['compactors']) - 1):
+            sketch._grow()
+
+        sketch.compactors = [list(compactor) for compactor in data['compactors']]
+        sketch.count = data['count']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        sketch.size = sum(len(compactor) for compactor in sketch.compactors)
+
+        return sketch
+
+
+class TimeDistributions:
+    '''
+    A sketch of every time saved per difficulty.
+    Deleted records are not removed, sketches only grow.
+    '''
+
+    def __init__(self) -> None:
+        self.sketches: dict[int, KLLSketch] = {}
+        self.dirty_difficulties: set[int] = set()
+        self.lock = Lock()
+
+    def add(self, difficulty: int, time: int) -> None:
+        with self.lock:
+            sketch = self.sketches.get(difficulty)
+
+            if sketch is None:
+                sketch = self.sketches[difficulty] = KLLSketch()
+
+            sketch.update(time)
+            self.dirty_difficulties.add(difficulty)
+
+    def load(self, sketches: dict[int, KLLSketch]) -> None:
+        '''
+        Merges the sketches, so times added before loading are kept.
+        '''
+        with self.lock:
+            for difficulty, sketch in sketches.items():
+                current_sketch = self.sketches.get(difficulty)
+
+                if current_sketch is not None:
+                    sketch.merge(current_sketch)
+                    self.dirty_difficulties.add(difficulty)
+
+                self.sketches[difficulty] = sketch
+
+    def get_summary(self, difficulty: int, fractions: Sequence[float], buckets: int) -> tuple[int, list[int | None], list[tuple[float, float, int]]]:
+        '''
+        Returns the count, the quantiles and the histogram of the difficulty.
+        '''
+        with self.lock:
+            sketch = self.sketches.get(difficulty)
+
+            if sketch is None:
+                return 0, [None for _ in fractions], []
+
+            return sketch.count, sketch.quantiles(fractions), sketch.histogram(buckets)
+
+    def pop_dirty(self) -> dict[int, dict[str, Any]]:
+        '''
+        Serialized sketches that changed since the last call.
+        '''
+        with self.lock:
+            dirty = {
+                difficulty: self.sketches[difficulty].to_dict()
+                for difficulty in self.dirty_difficulties
+            }
+            self.dirty_difficulties.clear()
+
+            return dirty
+
+    def mark_dirty(self, difficulties: Iterable[int]) -> None:
+        with self.lock:
+            self.dirty_difficulties.update(difficulties)
+
+
+time_distributions = TimeDistributions()
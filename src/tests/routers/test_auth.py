@@ -8,15 +8,19 @@ from routers.auth import (
     RefreshTokenClaims,
     decode_token,
     password_context,
+    password_hasher,
     Tokens
 )
 from database import DBConnection
+from rate_limiting import ip_rate_limiter, username_rate_limiter
 from freezegun import freeze_time
 from conftest import TestUser
 from datetime import datetime, timedelta, timezone
 from typing import Callable, Any
 import functools
 import settings
+import pytest
+import math
 
 AUTH_URL = '/api/auth'
 SIGNUP_URL = AUTH_URL + '/signup'
@@ -461,3 +465,50 @@ def test_create_test_account(client: TestClient, db: DBConnection) -> None:
 
     tokens, _ = generate_tokens_(db, row.id)
     assert tokens is not None
+
+
+def test_password_queue_limit(client: TestClient, db: DBConnection) -> None:
+    initial_max_queue_size = password_hasher.max_queue_size
+
+    try:
+        password_hasher.max_queue_size = 0
+
+        res = client.post(TEST_ACCOUNT_URL)
+        assert res.status_code == 503
+        assert res.headers['Retry-After'] == str(settings.PASSWORD_RETRY_AFTER_SECONDS)
+
+    finally:
+        password_hasher.max_queue_size = initial_max_queue_size
+
+    res = client.post(TEST_ACCOUNT_URL)
+    assert res.status_code == 201
+
+
+def test_rate_limits(client: TestClient, db: DBConnection, monkeypatch: pytest.MonkeyPatch) -> None:
+    credentials = {'username': 'RateLimitedUser', 'password': 'InvalidPassword1'}
+
+    monkeypatch.setattr(username_rate_limiter, 'capacity', 1)
+
+    try:
+        res = client.post(LOGIN_URL, json=credentials)
+        assert res.status_code == 401
+
+        res = client.post(LOGIN_URL, json=credentials)
+        assert res.status_code == 429
+        assert res.headers['Retry-After'] == str(math.ceil(60 / settings.RATE_LIMIT_USERNAME_PER_MINUTE))
+
+        # Limited by username, not by route
+        res = client.post(LOGOUT_URL + '/0', json=credentials)
+        assert res.status_code == 429
+
+        monkeypatch.setattr(ip_rate_limiter, 'capacity', 1)
+
+        res = client.post(LOGIN_URL, json={'username': 'OtherUser1', 'password': 'InvalidPassword1'})
+        assert res.status_code == 401
+
+        res = client.post(LOGIN_URL, json={'username': 'OtherUser2', 'password': 'InvalidPassword1'})
+        assert res.status_code == 429
+
+    finally:
+        ip_rate_limiter.clear()
+        username_rate_limiter.clear()
@@ -1,9 +1,13 @@
 from fastapi.testclient import TestClient
-from routers.games import Game, save_games_
+from routers.games import Game, GameChange, save_games_, get_game_hash, apply_game_changes
+from boards import DIFFICULTIES, REVEALED, generate_game
 from database import DBConnection
 from conftest import TestUser, assert_is_endpoint_authenticated, authenticate_requests, model2camel
 from datetime import datetime, timedelta
 from typing import Callable
+import settings
+import importlib
+import pytest
 import random
 
 GAMES_URL = '/api/games'
@@ -86,6 +90,11 @@ def test_delete_games(client: TestClient, user: TestUser, db: DBConnection) -> N
         assert row.difficulty != games[0]
 
 
+def is_revealed(encoded_game: str, difficulty: int, cell: tuple[int, int]) -> bool:
+    columns = DIFFICULTIES[difficulty].columns
+    return bool(int(encoded_game[cell[0] * columns + cell[1]]) & REVEALED)
+
+
 def test_update_games(client: TestClient, user: TestUser, db: DBConnection) -> None:
     assert_is_endpoint_authenticated(db, user, client.put, GAMES_URL)
 
@@ -99,6 +108,10 @@ def test_update_games(client: TestClient, user: TestUser, db: DBConnection) -> N
 
     games = create_games(db, user, save=False)
 
+    with authenticate_requests(user):
+        res = client.put(GAMES_URL, json={**model2camel(games[0]), 'encodedGame': '0' * (settings.MAX_ENCODED_GAME_LENGTH + 1)})
+        assert res.status_code == 422
+
     with authenticate_requests(user):
         res = client.put(GAMES_URL, json=model2camel(games[0]))
         assert res.status_code == 201
@@ -135,3 +148,156 @@ def test_update_games(client: TestClient, user: TestUser, db: DBConnection) -> N
     assert row is not None
 
     assert row.created_at == games[0].created_at
+
+
+def test_new_game(client: TestClient, user: TestUser, db: DBConnection) -> None:
+    url = GAMES_URL + '/new'
+
+    assert_is_endpoint_authenticated(db, user, client.post, url)
+
+    for params in ({}, {'difficulty': 69}, {'difficulty': 0, 'row': 0}, {'difficulty': 0, 'row': 9, 'column': 0}):
+        with authenticate_requests(user):
+            res = client.post(url, params=params)
+            assert res.status_code == 422
+
+    with authenticate_requests(user):
+        res = client.post(url, params={'difficulty': 2})
+        assert res.status_code == 200
+
+    new_game = res.json()
+    assert new_game['difficulty'] == 2
+    assert is_revealed(new_game['encodedGame'], 2, (8, 15))
+
+    # Same seed, same board
+    with authenticate_requests(user):
+        res = client.post(url, params={'difficulty': 2, 'seed': new_game['seed']})
+        assert res.status_code == 200
+
+    assert res.json() == new_game
+
+    with authenticate_requests(user):
+        res = client.post(url, params={'difficulty': 1, 'row': 15, 'column': 0})
+        assert res.status_code == 200
+
+    assert is_revealed(res.json()['encodedGame'], 1, (15, 0))
+
+    with authenticate_requests(user):
+        res = client.post(url, params={'difficulty': 0, 'seed': 1, 'no_guess': True})
+        assert res.status_code == 200
+
+    assert res.json()['encodedGame'] == generate_game(0, 1, no_guess=True)
+
+
+def test_patch_games(client: TestClient, user: TestUser, db: DBConnection, monkeypatch: pytest.MonkeyPatch) -> None:
+    url = GAMES_URL + '/0'
+    game = Game(difficulty=0, encoded_game='0123456789', created_at=10)
+
+    assert_is_endpoint_authenticated(db, user, client.patch, url)
+
+    def patch(base_created_at: float, changes: list[tuple[int, int, str]], base_hash: str | None = None, created_at: float | None = None) -> int:
+        if created_at is None:
+            created_at = base_created_at + 1
+
+        with authenticate_requests(user):
+            res = client.patch(url, json={
+                'baseCreatedAt': base_created_at,
+                'baseHash': base_hash,
+                'createdAt': created_at,
+                'changes': [{'start': start, 'end': end, 'value': value} for start, end, value in changes]
+            })
+
+        if res.status_code == 200:
+            assert res.json() == {'createdAt': created_at, 'hash': get_game_hash(get_encoded_game())}
+
+        return res.status_code
+
+    def get_encoded_game() -> str:
+        with authenticate_requests(user):
+            res = client.get(GAMES_URL)
+            assert res.status_code == 200
+
+        return res.json()[0]['encodedGame']
+
+    assert patch(10, [(0, 1, 'a')]) == 404
+
+    save_games_(db, user.id, game)
+
+    assert patch(10, [(0, 1, 'a'), (5, 7, ''), (8, 8, 'xyz')], get_game_hash(game.encoded_game)) == 200
+    assert get_encoded_game() == 'a1234789xyz'
+
+    # The base is now 11
+    assert patch(10, [(0, 1, 'b')]) == 409
+    assert patch(11, [(0, 1, 'b')], get_game_hash(game.encoded_game)) == 409
+    assert patch(11, [(5, 20, 'b')]) == 422
+    assert patch(11, [(5, 4, 'b')]) == 422
+    assert patch(11, [(0, 0, 'b' * (settings.MAX_ENCODED_GAME_LENGTH + 1))]) == 422
+    # Only the result is too long
+    assert patch(11, [(0, 0, 'b' * settings.MAX_ENCODED_GAME_LENGTH)]) == 422
+    assert get_encoded_game() == 'a1234789xyz'
+
+    assert patch(11, [(0, 11, 'new')]) == 200
+    assert get_encoded_game() == 'new'
+
+    # Two patches from the same base, only the first one is applied
+
+    assert patch(12, [(0, 1, 'A')], created_at=12) == 409
+    assert patch(12, [(0, 1, 'A')], created_at=11) == 409
+    assert get_encoded_game() == 'new'
+
+    assert patch(12, [(0, 1, 'A')]) == 200
+    assert patch(12, [(0, 1, 'B')]) == 409
+    assert get_encoded_game() == 'Aew'
+
+    # Another version saved after the base was read
+
+    def save_other_version(encoded_game: str, changes: list[GameChange]) -> str:
+        db.execute(
+            'UPDATE games '
+            'SET created_at = 20 '
+            'WHERE user_id = :user_id AND difficulty = 0;',
+            {'user_id': user.id}
+        )
+
+        return apply_game_changes(encoded_game, changes)
+
+    monkeypatch.setattr(importlib.import_module('routers.games'), 'apply_game_changes', save_other_version)
+
+    assert patch(13, [(0, 3, 'lost')]) == 409
+    assert get_encoded_game() == 'Aew'
+
+
+def test_compressed_games(client: TestClient, user: TestUser, db: DBConnection) -> None:
+    games = [
+        Game(difficulty=0, encoded_game='0' * 1_000 + '12', created_at=1),
+        Game(difficulty=1, encoded_game='7', created_at=2),
+    ]
+    save_games_(db, user.id, games)
+
+    # Rows saved before compression are plain text
+    db.execute(
+        'INSERT INTO games (user_id, difficulty, encoded_game, created_at) '
+        'VALUES (:user_id, 2, :encoded_game, 3);',
+        {'user_id': user.id, 'encoded_game': 'legacy'}
+    )
+
+    rows = db.fetch_many(
+        'SELECT encoded_game '
+        'FROM games '
+        'WHERE user_id = :user_id '
+        'ORDER BY difficulty;',
+        {'user_id': user.id}
+    )
+
+    assert isinstance(rows[0].encoded_game, bytes) and len(rows[0].encoded_game) < 100
+    assert rows[1].encoded_game == b'\x007'
+    assert rows[2].encoded_game == 'legacy'
+
+    with authenticate_requests(user):
+        res = client.get(GAMES_URL)
+        assert res.status_code == 200
+
+    assert sorted((game['difficulty'], game['encodedGame']) for game in res.json()) == [
+        (0, games[0].encoded_game),
+        (1, '7'),
+        (2, 'legacy'),
+    ]
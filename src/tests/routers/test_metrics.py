@@ -0,0 +1,59 @@
+from fastapi.testclient import TestClient
+from database import DBConnection, get_parameters_shape
+from conftest import TestUser, authenticate_requests
+from metrics import Histogram
+import settings
+
+
+METRICS_URL = '/api/metrics'
+
+
+def test_histogram() -> None:
+    histogram = Histogram(buckets=(1, 10))
+
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+
+    snapshot = histogram.snapshot()
+
+    assert snapshot['count'] == 4
+    assert snapshot['max'] == 50
+    assert snapshot['buckets'] == {'1': 2, '10': 1, 'inf': 1}
+
+
+def test_parameters_shape() -> None:
+    assert get_parameters_shape(None) == 'None'
+    assert get_parameters_shape({'user_id': 1, 'id': 'a'}) == '{user_id: int, id: str}'
+    assert get_parameters_shape([{'user_id': 1}, {'user_id': 2}]) == '2 x {user_id: int}'
+
+
+def test_get_metrics(client: TestClient, user: TestUser, db: DBConnection) -> None:
+    initial_metrics_token = settings.METRICS_TOKEN
+
+    try:
+        settings.METRICS_TOKEN = ''
+
+        res = client.get(METRICS_URL, headers={'Authorization': 'Bearer metrics_token'})
+        assert res.status_code == 404
+
+        settings.METRICS_TOKEN = 'metrics_token'
+
+        res = client.get(METRICS_URL)
+        assert res.status_code in (401, 403)
+
+        res = client.get(METRICS_URL, headers={'Authorization': 'Bearer wrong_token'})
+        assert res.status_code == 401
+
+        with authenticate_requests(user):
+            res = client.get('/api/users/me')
+            assert res.status_code == 200
+
+        res = client.get(METRICS_URL, headers={'Authorization': 'Bearer metrics_token'})
+        assert res.status_code == 200
+
+    finally:
+        settings.METRICS_TOKEN = initial_metrics_token
+
+    body = res.json()
+    assert body['counters']['db.query.users.get.rows'] >= 1
+    assert body['histograms']['db.query.users.get.duration_ms']['count'] >= 1
@@ -1,8 +1,14 @@
 from fastapi.testclient import TestClient
 from database import DBConnection
 from conftest import TestUser, assert_is_endpoint_authenticated, authenticate_requests, model2camel
-from routers.times import TimeRecord, save_time_records_
+from routers.times import TimeRecord, save_time_records_, refill_leaderboard
+from sketches import TimeDistributions
+from typing import Any, Sequence
+import settings
+import pytest
+import importlib
 import random
+import json
 from datetime import datetime
 
 
@@ -10,6 +16,7 @@ TimeRecords = tuple[TimeRecord, TimeRecord, TimeRecord]
 
 
 TIMES_URL = '/api/timerecords'
+LEADERBOARD_URL = TIMES_URL + '/leaderboard'
 
 S_TO_MS_FACTOR = 1_000
 
@@ -35,6 +42,10 @@ def create_time_records(db: DBConnection, user: TestUser, save: bool = True) ->
     return records[0], records[1], records[2]
 
 
+def sort_time_records(records: Sequence[TimeRecord]) -> list[TimeRecord]:
+    return sorted(records, key=lambda record: (record.created_at, record.id))
+
+
 def test_delete_time_records(client: TestClient, user: TestUser, db: DBConnection) -> None:
     assert_is_endpoint_authenticated(db, user, client.delete, TIMES_URL + '/id')
 
@@ -75,12 +86,68 @@ def test_get_time_records(client: TestClient, user: TestUser, db: DBConnection)
     assert res.json() == [] 
 
     records = create_time_records(db, user)
+    sorted_records = sort_time_records(records)
 
     with authenticate_requests(user):
         res = client.get(TIMES_URL)
         assert res.status_code == 200
 
-    assert res.json() == model2camel(records)
+    assert res.json() == model2camel(sorted_records)
+
+
+def test_get_time_records_pages(client: TestClient, user: TestUser, db: DBConnection) -> None:
+    records = create_time_records(db, user) + create_time_records(db, user)
+    sorted_records = sort_time_records(records)
+
+    with authenticate_requests(user):
+        res = client.get(TIMES_URL, params={'after': 'invalid_cursor'})
+        assert res.status_code == 422
+
+        res = client.get(TIMES_URL, params={'limit': 0})
+        assert res.status_code == 422
+
+    fetched_records: list[dict[str, Any]] = []
+    params: dict[str, Any] = {'limit': 4}
+
+    with authenticate_requests(user):
+        while True:
+            res = client.get(TIMES_URL, params=params)
+            assert res.status_code == 200
+
+            fetched_records += res.json()
+
+            if 'X-Next-Cursor' not in res.headers:
+                break
+
+            params['after'] = res.headers['X-Next-Cursor']
+
+    assert fetched_records == model2camel(sorted_records)
+
+    difficulty = records[0].difficulty
+
+    with authenticate_requests(user):
+        res = client.get(TIMES_URL, params={'difficulty': difficulty})
+        assert res.status_code == 200
+
+    assert res.json() == model2camel([record for record in sorted_records if record.difficulty == difficulty])
+
+
+def test_stream_time_records(client: TestClient, user: TestUser, db: DBConnection) -> None:
+    records = create_time_records(db, user)
+    sorted_records = sort_time_records(records)
+
+    with authenticate_requests(user):
+        res = client.get(TIMES_URL, params={'stream': True})
+        assert res.status_code == 200
+
+    assert res.headers['content-type'] == 'application/x-ndjson'
+    assert [json.loads(line) for line in res.text.splitlines()] == model2camel(sorted_records)
+
+    with authenticate_requests(user):
+        res = client.get(TIMES_URL, params={'stream': True, 'limit': 2})
+        assert res.status_code == 200
+
+    assert [json.loads(line) for line in res.text.splitlines()] == model2camel(sorted_records[:2])
 
 
 def test_create_time_records(client: TestClient, user: TestUser, db: DBConnection) -> None:
@@ -103,3 +170,241 @@ def test_create_time_records(client: TestClient, user: TestUser, db: DBConnectio
     with authenticate_requests(user):
         res = client.post(TIMES_URL, json=model2camel(records[0]))
         assert res.status_code == 409
+
+
+def test_leaderboard(client: TestClient, users: tuple[TestUser, TestUser, TestUser], db: DBConnection) -> None:
+    user1, user2, user3 = users
+
+    assert_is_endpoint_authenticated(db, user1, client.get, LEADERBOARD_URL + '/0')
+    assert_is_endpoint_authenticated(db, user1, client.get, LEADERBOARD_URL + '/0/rank')
+
+    def get_leaderboard() -> list[tuple[str, int]]:
+        with authenticate_requests(user1):
+            res = client.get(LEADERBOARD_URL + '/0')
+            assert res.status_code == 200
+
+        return [(entry['username'], entry['time']) for entry in res.json()]
+
+    def get_position(user: TestUser) -> int | None:
+        with authenticate_requests(user):
+            res = client.get(LEADERBOARD_URL + '/0/rank')
+
+        if res.status_code == 404:
+            return None
+
+        assert res.status_code == 200
+        return res.json()['position']
+
+    initial_leaderboard_size = settings.LEADERBOARD_SIZE
+
+    try:
+        settings.LEADERBOARD_SIZE = 2
+
+        assert get_leaderboard() == []
+        assert get_position(user1) is None
+
+        save_time_records_(db, user1.id, [
+            TimeRecord(id='1', difficulty=0, time=30, created_at=1),
+            TimeRecord(id='2', difficulty=0, time=20, created_at=2),
+            TimeRecord(id='3', difficulty=1, time=5, created_at=3),
+        ])
+        save_time_records_(db, user2.id, TimeRecord(id='4', difficulty=0, time=10, created_at=4))
+        save_time_records_(db, user3.id, TimeRecord(id='5', difficulty=0, time=25, created_at=5))
+
+        assert get_leaderboard() == [(user2.username, 10), (user1.username, 20)]
+        assert get_position(user2) == 1
+        assert get_position(user1) == 2
+        assert get_position(user3) is None
+
+        # Records that are not in the leaderboard leave it as it is
+
+        with authenticate_requests(user1):
+            res = client.delete(TIMES_URL + '/1')
+            assert res.status_code == 204
+
+        rows = db.fetch_many(
+            'SELECT user_id '
+            'FROM leaderboard '
+            'WHERE difficulty = 0;'
+        )
+        assert sorted(row.user_id for row in rows) == sorted([user1.id, user2.id])
+
+        save_time_records_(db, user1.id, TimeRecord(id='1', difficulty=0, time=30, created_at=1))
+
+        # The next best time takes the place of the deleted one
+
+        with authenticate_requests(user2):
+            res = client.delete(TIMES_URL + '/4')
+            assert res.status_code == 204
+
+        assert get_leaderboard() == [(user1.username, 20), (user3.username, 25)]
+
+        with authenticate_requests(user1):
+            res = client.delete(TIMES_URL + '/2')
+            assert res.status_code == 204
+
+        assert get_leaderboard() == [(user3.username, 25), (user1.username, 30)]
+        assert get_position(user2) is None
+
+        # Filled again from the records only when the size changes or they are empty
+        refill_leaderboard(db, 2)
+        assert get_leaderboard() == [(user3.username, 25), (user1.username, 30)]
+
+        settings.LEADERBOARD_SIZE = 1
+        refill_leaderboard(db, settings.LEADERBOARD_SIZE)
+        assert get_leaderboard() == [(user3.username, 25)]
+
+        db.execute('UPDATE leaderboard SET time = 1;')
+        refill_leaderboard(db, settings.LEADERBOARD_SIZE)
+        assert get_leaderboard() == [(user3.username, 1)]
+
+        db.execute('DELETE FROM leaderboard;')
+        refill_leaderboard(db, settings.LEADERBOARD_SIZE)
+        assert get_leaderboard() == [(user3.username, 25)]
+
+    finally:
+        settings.LEADERBOARD_SIZE = initial_leaderboard_size
+
+
+def test_time_stats(client: TestClient, user: TestUser, db: DBConnection) -> None:
+    assert_is_endpoint_authenticated(db, user, client.get, TIMES_URL + '/stats')
+
+    def get_stats() -> list[dict[str, Any]]:
+        with authenticate_requests(user):
+            res = client.get(TIMES_URL + '/stats')
+            assert res.status_code == 200
+
+        return res.json()
+
+    initial_trend_window = settings.STATS_TREND_WINDOW
+
+    try:
+        settings.STATS_TREND_WINDOW = 2
+
+        assert get_stats() == []
+
+        save_time_records_(db, user.id, [
+            TimeRecord(id=str(id), difficulty=0, time=time, created_at=id)
+            for id, time in enumerate((40, 30, 20, 10, 50))
+        ])
+        save_time_records_(db, user.id, TimeRecord(id='5', difficulty=1, time=5, created_at=5))
+
+        stats = [
+            {'difficulty': 0, 'count': 5, 'best': 10, 'mean': 30.0, 'median': 30.0, 'p90': 46.0, 'trend': -20.0},
+            {'difficulty': 1, 'count': 1, 'best': 5, 'mean': 5.0, 'median': 5.0, 'p90': 5.0, 'trend': None},
+        ]
+
+        assert get_stats() == stats
+        # Saved stats
+        assert get_stats() == stats
+
+        with authenticate_requests(user):
+            assert client.delete(TIMES_URL + '/3').status_code == 204
+            assert client.delete(TIMES_URL + '/5').status_code == 204
+
+        assert get_stats() == [
+            {'difficulty': 0, 'count': 4, 'best': 20, 'mean': 35.0, 'median': 35.0, 'p90': 47.0, 'trend': 0.0},
+        ]
+
+    finally:
+        settings.STATS_TREND_WINDOW = initial_trend_window
+
+
+def test_time_rank(client: TestClient, users: tuple[TestUser, TestUser, TestUser], db: DBConnection) -> None:
+    user1, user2, user3 = users
+
+    # Not used by other tests, the rank index is shared by the whole process
+    difficulty = 100
+    rank_url = TIMES_URL + f'/rank/{difficulty}'
+
+    assert_is_endpoint_authenticated(db, user1, client.get, rank_url)
+
+    def get_rank(user: TestUser, time: int | None = None) -> dict[str, Any] | None:
+        with authenticate_requests(user):
+            res = client.get(rank_url, params={} if time is None else {'time': time})
+
+        if res.status_code == 404:
+            return None
+
+        assert res.status_code == 200
+        return res.json()
+
+    assert get_rank(user1) is None
+    assert get_rank(user1, 10) == {'time': 10, 'rank': 1, 'players': 0, 'percentile': 0.0}
+
+    save_time_records_(db, user1.id, [
+        TimeRecord(id='1', difficulty=difficulty, time=30, created_at=1),
+        TimeRecord(id='2', difficulty=difficulty, time=20, created_at=2),
+    ])
+    save_time_records_(db, user2.id, TimeRecord(id='3', difficulty=difficulty, time=10, created_at=3))
+    save_time_records_(db, user3.id, TimeRecord(id='4', difficulty=difficulty, time=40, created_at=4))
+    save_time_records_(db, user3.id, TimeRecord(id='5', difficulty=difficulty, time=50, created_at=5))
+
+    # Updated once committed
+    assert get_rank(user1) is None
+    db.run_commit_callbacks()
+
+    assert get_rank(user1) == {'time': 20, 'rank': 2, 'players': 3, 'percentile': 1 / 3 * 100}
+    assert get_rank(user2) == {'time': 10, 'rank': 1, 'players': 3, 'percentile': 2 / 3 * 100}
+    assert get_rank(user3, 5) == {'time': 5, 'rank': 1, 'players': 3, 'percentile': 100.0}
+    assert get_rank(user3, 100)['rank'] == 4  # type: ignore
+
+    # Deleting the best time falls back to the next one
+
+    with authenticate_requests(user1):
+        res = client.delete(TIMES_URL + '/2')
+        assert res.status_code == 204
+
+    db.run_commit_callbacks()
+    assert get_rank(user1) == {'time': 30, 'rank': 2, 'players': 3, 'percentile': 1 / 3 * 100}
+
+    with authenticate_requests(user2):
+        res = client.delete(TIMES_URL + '/3')
+        assert res.status_code == 204
+
+    db.run_commit_callbacks()
+    assert get_rank(user2) is None
+    assert get_rank(user1)['players'] == 2  # type: ignore
+
+
+def test_time_distribution(client: TestClient, user: TestUser, db: DBConnection, monkeypatch: pytest.MonkeyPatch) -> None:
+    # The package exports the router as `routers.times`
+    monkeypatch.setattr(importlib.import_module('routers.times'), 'time_distributions', TimeDistributions())
+
+    difficulty = 0
+    distribution_url = TIMES_URL + f'/distribution/{difficulty}'
+
+    assert_is_endpoint_authenticated(db, user, client.get, distribution_url)
+
+    with authenticate_requests(user):
+        res = client.get(distribution_url)
+        assert res.status_code == 404
+
+    save_time_records_(db, user.id, [
+        TimeRecord(id=str(time), difficulty=difficulty, time=time, created_at=time)
+        for time in range(1, 101)
+    ])
+
+    # Added once committed
+    with authenticate_requests(user):
+        res = client.get(distribution_url)
+        assert res.status_code == 404
+
+    db.run_commit_callbacks()
+
+    with authenticate_requests(user):
+        res = client.get(distribution_url, params={'buckets': 4})
+        assert res.status_code == 200
+
+    assert res.json() == {
+        'count': 100,
+        'p10': 10,
+        'p50': 50,
+        'p90': 90,
+        'histogram': [
+            {'start': 1.0, 'end': 25.75, 'count': 25},
+            {'start': 25.75, 'end': 50.5, 'count': 25},
+            {'start': 50.5, 'end': 75.25, 'count': 25},
+            {'start': 75.25, 'end': 100.0, 'count': 25},
+        ]
+    }
@@ -2,7 +2,7 @@ from fastapi.testclient import TestClient
 from database import DBConnection
 from conftest import TestUser, assert_is_endpoint_authenticated, authenticate_requests, model2camel
 from tests.routers.test_games import create_games
-from tests.routers.test_times import create_time_records
+from tests.routers.test_times import create_time_records, sort_time_records
 from tests.routers.test_game_settings import create_game_settings
 from routers.games import Game
 from routers.times import TimeRecord
@@ -74,7 +74,7 @@ def test_get_sync_data(client: TestClient, user: TestUser, db: DBConnection) ->
 
     assert body == {
         'games': model2camel(games),
-        'timeRecords': model2camel(records),
+        'timeRecords': model2camel(sort_time_records(records)),
         'settings': model2camel(game_settings)
     }
 
@@ -151,7 +151,7 @@ def test_update_sync_data(client: TestClient, user: TestUser, db: DBConnection)
 
     assert body == {
         'games': model2camel(games),
-        'timeRecords': model2camel(records),
+        'timeRecords': model2camel(sort_time_records(records)),
         'settings': model2camel(game_settings)
     }
 
@@ -178,7 +178,10 @@ def test_update_sync_data(client: TestClient, user: TestUser, db: DBConnection)
 
     body = res.json()
 
-    assert body == data
+    assert body == {
+        **data,
+        'timeRecords': model2camel(sort_time_records(records + (new_record,)))
+    }
 
     g0 = games[0]
     modified_game = Game(
@@ -201,6 +204,6 @@ def test_update_sync_data(client: TestClient, user: TestUser, db: DBConnection)
 
     assert body == {
         'games': model2camel(games),
-        'timeRecords': model2camel(records + (new_record,)),
+        'timeRecords': model2camel(sort_time_records(records + (new_record,))),
         'settings': model2camel(game_settings)
     }
@@ -0,0 +1,109 @@
+from boards import (
+    DIFFICULTIES, MINE, REVEALED, FLAGGED, Board,
+    encode_board, generate_game, sum_neighbors, place_mines, is_solvable, deduce_locally, deduce_globally
+)
+from board_pool import BoardPool
+import numpy as np
+import time
+
+
+def decode_board(encoded_game: str, difficulty: int) -> Board:
+    rows, columns, _ = DIFFICULTIES[difficulty]
+    return (np.frombuffer(encoded_game.encode('ascii'), dtype=np.uint8) - np.uint8(ord('0'))).reshape(rows, columns)
+
+
+def test_encode_board() -> None:
+    rows, columns, mines = DIFFICULTIES[1]
+    encoded_game = (str(MINE) * mines + str(REVEALED) * 20 + str(FLAGGED) * 3).ljust(rows * columns, '0')
+
+    board = decode_board(encoded_game, 1)
+    assert encode_board(board) == encoded_game
+
+    # Revealed cells cannot be flagged
+    board[-1, -1] = REVEALED | FLAGGED
+    assert encode_board(board) == encoded_game[:-1] + str(REVEALED)
+
+
+def test_generate_board() -> None:
+    for difficulty, (rows, columns, mines) in DIFFICULTIES.items():
+        first_click = (0, columns - 1)
+        board = decode_board(generate_game(difficulty, 69, first_click), difficulty)
+
+        assert np.count_nonzero(board & MINE) == mines
+        assert not (board[:2, -2:] & MINE).any()
+        assert board[first_click] & REVEALED
+        assert generate_game(difficulty, 69, first_click) == encode_board(board)
+
+        # Cells without neighbor mines reveal their neighbors
+        mine_mask = (board & MINE).astype(np.uint8)
+        neighbor_mines = sum_neighbors(mine_mask)
+        revealed = (board & REVEALED) > 0
+
+        for row in range(rows):
+            for column in range(columns):
+                expected_neighbor_mines = mine_mask[max(row - 1, 0):row + 2, max(column - 1, 0):column + 2].sum() - mine_mask[row, column]
+                assert neighbor_mines[row, column] == expected_neighbor_mines
+
+                if revealed[row, column] and neighbor_mines[row, column] == 0:
+                    assert revealed[max(row - 1, 0):row + 2, max(column - 1, 0):column + 2].all()
+
+
+def test_no_guess_board() -> None:
+    rng = np.random.default_rng(0)
+    first_click = (0, 0)
+    solvable_boards = 0
+
+    for _ in range(100):
+        mine_mask = place_mines(1, first_click, rng)
+        solvable_boards += is_solvable(mine_mask, sum_neighbors(mine_mask.astype(np.uint8)), first_click)
+
+    # Not every board
+    assert 0 < solvable_boards < 100
+
+    # 1 1 1 1  Needs the linear solver, no number solves it alone
+    # * ? ? *
+    mine_mask = np.zeros((2, 4), dtype=np.bool_)
+    mine_mask[1, [0, 3]] = True
+    neighbor_mines = sum_neighbors(mine_mask.astype(np.uint8))
+    revealed = ~mine_mask
+    revealed[1] = False
+    known_mines = np.zeros_like(mine_mask)
+
+    safe, mines = deduce_locally(revealed, known_mines, neighbor_mines)
+    assert not safe.any() and not mines.any()
+
+    safe, mines = deduce_globally(revealed, known_mines, neighbor_mines)
+    assert np.argwhere(safe).tolist() == [[1, 1], [1, 2]]
+    assert np.argwhere(mines).tolist() == [[1, 0], [1, 3]]
+
+    # 50/50
+    mine_mask = np.zeros((2, 3), dtype=np.bool_)
+    mine_mask[1, 2] = True
+    neighbor_mines = sum_neighbors(mine_mask.astype(np.uint8))
+    assert not is_solvable(mine_mask, neighbor_mines, (0, 0))
+
+    board = decode_board(generate_game(2, 69, no_guess=True), 2)
+    mine_mask = (board & MINE) > 0
+    assert is_solvable(mine_mask, sum_neighbors(mine_mask.astype(np.uint8)), (8, 15))
+
+
+def test_board_pool() -> None:
+    pool = BoardPool('test', 2, 0, generate_game)
+
+    assert pool.pop(0) is None
+
+    pool.start()
+
+    try:
+        deadline = time.monotonic() + 5
+
+        while any(len(games) < 2 for games in pool.games.values()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        seed, encoded_game = pool.pop(2)  # type: ignore
+        assert encoded_game == generate_game(2, seed)
+
+    finally:
+        pool.stop()
+
+    assert pool.thread is None
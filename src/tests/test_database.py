@@ -0,0 +1,86 @@
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from database import DBConnection, RetryPolicy, StatementRegistry
+import asyncio
+import pytest
+
+
+def get_locked_error() -> OperationalError:
+    return OperationalError('UPDATE auth ...', {}, Exception('database is locked'))
+
+
+def test_retry_policy_delay() -> None:
+    retry_policy = RetryPolicy(max_attempts=5, base_delay=0.01, max_delay=0.05)
+
+    for attempt in range(10):
+        delay = retry_policy.get_delay(attempt)
+        assert 0 <= delay <= min(0.05, 0.01 * 2 ** attempt)
+
+
+def test_retry_policy_run() -> None:
+    retry_policy = RetryPolicy(max_attempts=2, base_delay=0, max_delay=0)
+    calls: list[int] = []
+
+    async def flaky_call(fail_times: int) -> str:
+        calls.append(1)
+
+        if len(calls) <= fail_times:
+            raise get_locked_error()
+
+        return 'done'
+
+    assert asyncio.run(retry_policy.run(lambda: flaky_call(2))) == 'done'
+    assert len(calls) == 3
+
+    calls.clear()
+
+    with pytest.raises(OperationalError):
+        asyncio.run(retry_policy.run(lambda: flaky_call(3)))
+
+    assert len(calls) == 3
+
+    async def failing_call() -> None:
+        calls.append(1)
+        raise ValueError()
+
+    calls.clear()
+
+    with pytest.raises(ValueError):
+        asyncio.run(retry_policy.run(failing_call))
+
+    assert len(calls) == 1
+
+
+def test_commit_callbacks() -> None:
+    engine = create_engine('sqlite+pysqlite:///:memory:')
+    calls: list[str] = []
+
+    with engine.connect() as conn:
+        db = DBConnection(conn)
+
+        db.on_commit(lambda: calls.append('rolled back'))
+        db.rollback()
+
+        db.on_commit(lambda: calls.append('committed'))
+        assert not calls
+
+        db.commit()
+        db.commit()
+
+    engine.dispose()
+
+    assert calls == ['committed']
+
+
+def test_statement_registry() -> None:
+    registry = StatementRegistry()
+    registry.register('test.select', 'SELECT 1;')
+
+    assert registry.get('test.select') is registry.get('test.select')
+    assert registry.get('SELECT 2;').text == 'SELECT 2;'
+
+    with pytest.raises(KeyError):
+        registry.get('test.selcet')
+
+    with pytest.raises(Exception):
+        registry.register('test.select', 'SELECT 3;')
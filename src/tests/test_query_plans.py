@@ -0,0 +1,73 @@
+from sqlalchemy import text
+from database import DBConnection, statements
+import re
+
+
+# Statements that are expected to read whole tables, eg: only run at startup
+FULL_SCAN_STATEMENTS: set[str] = {
+    'times.get_best_times', 'times.get_all_times', 'times.get_distributions', 'times.clear_leaderboard', 'times.fill_leaderboard',
+    'times.get_leaderboard_size'
+}
+
+# `SCAN <table>` or `SCAN <table> USING [COVERING] INDEX <index>` without a search constraint
+full_scan_pattern = re.compile(r'^SCAN (?!CONSTANT ROW)')
+
+# `SEARCH <table> [AS <alias>] USING ... (<constraints>)`
+search_pattern = re.compile(r'^SEARCH (\w+)(?: AS \w+)? USING .*?\((.*)\)$')
+
+
+def test_registered_statements_use_indexes(db: DBConnection) -> None:
+    assert statements.statements
+
+    full_scans: dict[str, list[str]] = {}
+
+    for name, statement in statements.statements.items():
+        if name in FULL_SCAN_STATEMENTS:
+            continue
+
+        parameters = {parameter: None for parameter in statement._bindparams}
+
+        rows = db.connection.execute(text('EXPLAIN QUERY PLAN ' + statement.text), parameters).all()
+
+        details = [row.detail for row in rows if full_scan_pattern.match(row.detail)]
+
+        if details:
+            full_scans[name] = details
+
+    assert full_scans == {}
+
+
+def test_user_statements_search_by_user(db: DBConnection) -> None:
+    '''
+    Statements filtered by `:user_id` must search the tables that have that column by it,
+    not by another leading column (eg: every record of a difficulty).
+    '''
+    tables = db.fetch_many("SELECT name FROM sqlite_master WHERE type = 'table';")
+    user_tables = {
+        table.name
+        for table in tables
+        if any(column.name == 'user_id' for column in db.fetch_many(f'PRAGMA table_info({table.name});'))
+    }
+
+    assert 'time_records' in user_tables
+
+    searches_without_user: dict[str, list[str]] = {}
+
+    for name, statement in statements.statements.items():
+        if ':user_id' not in statement.text or name in FULL_SCAN_STATEMENTS:
+            continue
+
+        parameters = {parameter: None for parameter in statement._bindparams}
+
+        rows = db.connection.execute(text('EXPLAIN QUERY PLAN ' + statement.text), parameters).all()
+
+        details = [
+            row.detail
+            for row in rows
+            if (match := search_pattern.match(row.detail)) and match.group(1) in user_tables and 'user_id=' not in match.group(2)
+        ]
+
+        if details:
+            searches_without_user[name] = details
+
+    assert searches_without_user == {}
@@ -0,0 +1,43 @@
+from ranking import RankIndex
+from threading import Thread
+
+
+def test_rank_index() -> None:
+    rank_index = RankIndex()
+    rank_index.rebuild([(0, 1, 30), (0, 2, 10), (0, 3, 20), (1, 1, 5)])
+
+    assert rank_index.get_rank(0, 20) == (2, 3, 1)
+    assert rank_index.get_rank(0, 15) == (2, 3, 2)
+    assert rank_index.get_rank(0, 1) == (1, 3, 3)
+    assert rank_index.get_rank(1, 5) == (1, 1, 0)
+    assert rank_index.get_rank(2, 5) == (1, 0, 0)
+
+    # Slower times do not replace the best one
+    rank_index.add_time(0, 1, 40)
+    assert rank_index.get_best_time(0, 1) == 30
+
+    rank_index.add_time(0, 1, 5)
+    assert rank_index.get_best_time(0, 1) == 5
+    assert rank_index.get_rank(0, 20) == (3, 3, 0)
+
+    rank_index.set_best_time(0, 1, None)
+    assert rank_index.get_best_time(0, 1) is None
+    assert rank_index.get_rank(0, 20) == (2, 2, 0)
+
+
+def test_rank_index_concurrent_add_time() -> None:
+    rank_index = RankIndex()
+
+    threads = [
+        Thread(target=rank_index.add_time, args=(0, 1, time))
+        for time in range(100, 0, -1)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert rank_index.get_best_time(0, 1) == 1
+    assert rank_index.get_rank(0, 1) == (1, 1, 0)
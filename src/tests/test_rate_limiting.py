@@ -0,0 +1,41 @@
+from fastapi import HTTPException
+from freezegun import freeze_time
+from rate_limiting import RateLimiter
+from metrics import metrics
+from datetime import timedelta
+import pytest
+
+
+def test_rate_limiter() -> None:
+    limiter = RateLimiter('test', capacity=2, refill_per_minute=60, max_keys=1_000)
+
+    with freeze_time('2000-01-01 00:00:00') as frozen_time:
+        assert limiter.acquire('a') == 0
+        assert limiter.acquire('a') == 0
+        assert limiter.acquire('a') == pytest.approx(1)
+
+        # Keys do not share buckets
+        assert limiter.acquire('b') == 0
+
+        frozen_time.tick(timedelta(seconds=0.5))
+        assert limiter.acquire('a') == pytest.approx(0.5)
+
+        frozen_time.tick(timedelta(seconds=0.5))
+        assert limiter.acquire('a') == 0
+
+        # Never more than the capacity
+        frozen_time.tick(timedelta(minutes=10))
+        assert limiter.acquire('a') == 0
+        assert limiter.acquire('a') == 0
+        assert limiter.acquire('a') > 0
+
+        rejected = metrics.get_counter('rate_limit.test.rejected')
+
+        with pytest.raises(HTTPException) as exception_info:
+            limiter.check('a')
+
+        assert exception_info.value.status_code == 429
+        assert exception_info.value.headers == {'Retry-After': '1'}
+        assert metrics.get_counter('rate_limit.test.rejected') == rejected + 1
+
+    assert RateLimiter('disabled', capacity=0, refill_per_minute=0, max_keys=1_000).acquire('a') == 0
@@ -0,0 +1,78 @@
+from freezegun import freeze_time
+from session_cache import SessionCache, SessionState, session_cache
+from routers.auth import generate_tokens_, refresh_tokens_
+from database import DBConnection
+from conftest import TestUser
+from metrics import metrics
+from datetime import timedelta
+
+
+def test_session_cache() -> None:
+    cache = SessionCache(max_size=2, ttl_seconds=60)
+    state = SessionState(token_id=0, family_id=0, is_invalidated=False)
+
+    with freeze_time('2000-01-01 00:00:00') as frozen_time:
+        cache.put((1, 0), state)
+        cache.put((1, 1), state)
+        assert cache.get((1, 0)) == state
+
+        # Least recently used
+        cache.put((2, 0), state)
+        assert cache.get((1, 1)) is None
+        assert cache.get((1, 0)) == state
+
+        cache.pop((1, 0))
+        assert cache.get((1, 0)) is None
+
+        evictions = metrics.get_counter('auth.session_cache.evictions')
+
+        frozen_time.tick(timedelta(seconds=60))
+        assert cache.get((2, 0)) is None
+        assert metrics.get_counter('auth.session_cache.evictions') == evictions + 1
+
+
+def test_refresh_tokens_session_cache(user: TestUser, db: DBConnection) -> None:
+    session_cache.clear()
+
+    try:
+        tokens, _ = generate_tokens_(db, user.id)
+        assert tokens is not None
+
+        # Not cached until committed
+        assert session_cache.get((user.id, tokens.device_id)) is None
+
+        db.run_commit_callbacks()
+        assert session_cache.get((user.id, tokens.device_id)) == SessionState(0, 0, False)
+
+        tokens, _ = refresh_tokens_(db, tokens.refresh_token)
+        assert tokens is not None
+
+        db.run_commit_callbacks()
+        assert session_cache.get((user.id, tokens.device_id)) == SessionState(1, 0, False)
+
+        old_tokens = tokens
+
+        tokens, _ = generate_tokens_(db, user.id, tokens.device_id)
+        assert tokens is not None
+
+        db.run_commit_callbacks()
+        assert session_cache.get((user.id, tokens.device_id)) == SessionState(0, 1, False)
+
+        # Rejected without reading the session
+        rejected_refreshes = metrics.get_counter('auth.session_cache.rejected_refreshes')
+        get_session_queries = metrics.get_counter('db.query.auth.get_session.rows')
+
+        new_tokens, error_msg = refresh_tokens_(db, old_tokens.refresh_token)
+        assert new_tokens is None
+        assert error_msg == 'Token family ID does not match.'
+
+        assert metrics.get_counter('auth.session_cache.rejected_refreshes') == rejected_refreshes + 1
+        assert metrics.get_counter('db.query.auth.get_session.rows') == get_session_queries
+
+        # Rolled back changes are not cached
+        refresh_tokens_(db, tokens.refresh_token)
+        db.rollback()
+        assert session_cache.get((user.id, tokens.device_id)) is None
+
+    finally:
+        session_cache.clear()
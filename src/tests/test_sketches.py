@@ -0,0 +1,55 @@
+from sketches import KLLSketch
+import random
+
+
+def assert_quantiles(sketch: KLLSketch, values: list[int]) -> None:
+    values = sorted(values)
+    fractions = (0.1, 0.5, 0.9)
+
+    for fraction, quantile in zip(fractions, sketch.quantiles(fractions)):
+        assert quantile is not None
+
+        rank = sum(value <= quantile for value in values) / len(values)
+        assert abs(rank - fraction) < 0.02
+
+
+def test_kll_sketch() -> None:
+    random.seed(0)
+
+    assert KLLSketch().quantiles((0.5,)) == [None]
+    assert KLLSketch().histogram(10) == []
+
+    values = [random.randint(1_000, 600_000) for _ in range(20_000)]
+    sketch = KLLSketch()
+
+    for value in values:
+        sketch.update(value)
+
+    assert sketch.count == len(values)
+    assert sketch.size < 1_000
+    assert_quantiles(sketch, values)
+
+    histogram = sketch.histogram(50)
+    assert len(histogram) == 50
+    assert histogram[0][0] == min(values) and histogram[-1][1] == max(values)
+    assert abs(sum(count for _, _, count in histogram) - len(values)) <= 50
+
+    # Merge
+
+    other_values = [random.randint(1_000, 100_000) for _ in range(10_000)]
+    other_sketch = KLLSketch()
+
+    for value in other_values:
+        other_sketch.update(value)
+
+    sketch.merge(other_sketch)
+    assert sketch.count == len(values) + len(other_values)
+    assert_quantiles(sketch, values + other_values)
+
+    # Checkpoint
+
+    loaded_sketch = KLLSketch.from_dict(sketch.to_dict())
+    assert loaded_sketch.quantiles((0.1, 0.5, 0.9)) == sketch.quantiles((0.1, 0.5, 0.9))
+
+    loaded_sketch.update(1)
+    assert loaded_sketch.min == 1 and loaded_sketch.count == sketch.count + 1
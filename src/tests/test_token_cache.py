@@ -0,0 +1,51 @@
+from fastapi.security import HTTPAuthorizationCredentials
+from freezegun import freeze_time
+from token_cache import VerifiedTokenCache, token_cache
+from routers.auth import authenticate_user, encode_token
+from metrics import metrics
+from datetime import datetime, timedelta
+
+
+def test_verified_token_cache() -> None:
+    cache = VerifiedTokenCache(max_size=2)
+
+    with freeze_time('2000-01-01 00:00:00') as frozen_time:
+        exp = datetime.now().timestamp() + 60
+
+        cache.put('token1', 1, exp)
+        cache.put('token2', 2, exp)
+        assert cache.get('token1') == 1
+
+        # Least recently used
+        cache.put('token3', 3, exp)
+        assert cache.get('token2') is None
+        assert cache.get('token1') == 1
+        assert cache.get('token3') == 3
+
+        evictions = metrics.get_counter('auth.token_cache.evictions')
+
+        frozen_time.tick(timedelta(seconds=60))
+        assert cache.get('token1') is None
+        assert metrics.get_counter('auth.token_cache.evictions') == evictions + 1
+
+        # Already expired
+        cache.put('token4', 4, exp)
+        assert cache.get('token4') is None
+
+
+def test_authenticate_user_cache() -> None:
+    token_cache.clear()
+
+    access_token = encode_token({'sub': '69', 'type': 'access', 'exp': datetime.now().timestamp() + 60})
+    assert access_token is not None
+
+    credentials = HTTPAuthorizationCredentials(scheme='Bearer', credentials=access_token)
+
+    hits = metrics.get_counter('auth.token_cache.hits')
+    misses = metrics.get_counter('auth.token_cache.misses')
+
+    assert authenticate_user(credentials) == 69
+    assert authenticate_user(credentials) == 69
+
+    assert metrics.get_counter('auth.token_cache.misses') == misses + 1
+    assert metrics.get_counter('auth.token_cache.hits') == hits + 1
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from threading import Lock
+from metrics import metrics
+import settings
+import hashlib
+import time
+
+
+class VerifiedTokenCache:
+    '''
+    LRU cache of verified access tokens, keyed by their SHA-256 digest so the tokens are not kept in memory.
+    Entries are evicted at their `exp`, so a cached token is never accepted after it expires.
+
+    Metrics: `auth.token_cache.{hits,misses,evictions}`.
+    '''
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # digest -> (user_id, exp)
+        self.entries: OrderedDict[bytes, tuple[int, float]] = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def _get_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> int | None:
+        key = self._get_key(token)
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[1] <= time.time():
+                del self.entries[key]
+                entry = None
+                metrics.increment('auth.token_cache.evictions')
+
+            if entry is None:
+                metrics.increment('auth.token_cache.misses')
+                return None
+
+            self.entries.move_to_end(key)
+
+        metrics.increment('auth.token_cache.hits')
+
+        return entry[0]
+
+    def put(self, token: str, user_id: int, exp: float) -> None:
+        if self.max_size <= 0 or exp <= time.time():
+            return
+
+        key = self._get_key(token)
+
+        with self.lock:
+            self.entries[key] = (user_id, exp)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                metrics.increment('auth.token_cache.evictions')
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = VerifiedTokenCache(settings.TOKEN_CACHE_SIZE)